@@ -0,0 +1,334 @@
+import argparse
+import ast
+import itertools
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Offline benchmarks for mergedTikTokApi: a mock TikTokApi serves payloads generated from sampleTikTokObj.txt and a
+# local http server stands in for the video CDN, so nothing here talks to TikTok.
+#   python benchmarkTikTokApi.py --sizes 10 1000 --latency 0.005 --errorRate 0.01
+
+SAMPLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sampleTikTokObj.txt')
+SIZES = [10, 1000, 100000]
+CASES = ['processTikTokObject', 'records', 'getTrendingTikToks', 'byUsername', 'getSuggestedUsers', 'downloadTikToks', 'main']
+
+#### Synthetic Payloads ####
+
+class PayloadFactory: # builds api responses from the sample itemStruct, varying ids, authors, stats and playAddr
+  # items share the sample's nested dicts except the ones that vary, so 100k of them stay cheap to build
+  def __init__(self, samplePath:str = SAMPLE_PATH, cdnUrl:str = None, seed:int = 0):
+    with open(samplePath) as f:
+      self.sample = ast.literal_eval(f.read())['itemInfo']['itemStruct'] # a python repr, not json
+    self.cdnUrl = cdnUrl
+    self.seed = seed
+
+  def item(self, key:str, i:int) -> dict: # the i-th video of a feed (a username, hashtag or 'trending')
+    base = zlib.crc32(('%s:%s' % (self.seed, key)).encode()) + i * 7919
+    id = '%s_%d' % (key, i)
+    return dict(self.sample,
+      id = id,
+      createTime = self.sample['createTime'] - i * 60,
+      video = dict(self.sample['video'], playAddr = self.cdnUrl + '/video/' + id + '.mp4' if self.cdnUrl else self.sample['video']['playAddr']),
+      author = dict(self.sample['author'], uniqueId = key),
+      stats = {name: (base * (j + 1)) % 10 ** 6 for j, name in enumerate(('diggCount', 'shareCount', 'commentCount', 'playCount'))},
+    )
+
+  def legacyItem(self, key:str, i:int) -> dict: # the older itemInfos/authorInfos shape byHashtag returns
+    item = self.item(key, i)
+    return {
+      'itemInfos': dict(item['stats'], id = item['id'], text = item['desc'], createTime = str(item['createTime']), video = {'urls': [item['video']['playAddr']]}),
+      'authorInfos': {'uniqueId': item['author']['uniqueId']},
+    }
+
+  def user(self, username:str) -> dict:
+    base = zlib.crc32(('%s:%s' % (self.seed, username)).encode())
+    return {
+      'user': {'id': 'id_' + username, 'uniqueId': username, 'secUid': 'sec_' + username, 'verified': base % 10 == 0},
+      'stats': {name: (base * (j + 1)) % 10 ** 6 for j, name in enumerate(('followingCount', 'followerCount', 'heartCount', 'videoCount', 'diggCount'))},
+    }
+
+#### Mock TikTokApi ####
+
+class MockTikTokApi: # stands in for TikTokApi.TikTokApi with the methods and response shapes mergedTikTokApi uses
+  # like TikTokApi 3.7+, only one instance may exist per process and it only answers on the thread that created it
+  payloads = None
+  latency = 0.0 # seconds slept by every call
+  errorRate = 0.0 # fraction of calls that raise
+  startupSeconds = 0.0 # slept by the constructor, like launching chromium
+  videosPerUser = 1000
+  counter = itertools.count()
+  instances = 0
+
+  def __init__(self, **apiKwargs):
+    if MockTikTokApi.instances:
+      raise Exception("Only one TikTokApi object is allowed")
+    MockTikTokApi.instances += 1
+    self.thread = threading.current_thread()
+    time.sleep(self.startupSeconds)
+
+  def _call(self):
+    if threading.current_thread() is not self.thread:
+      raise RuntimeError("TikTokApi used from a thread other than the one that created it")
+    if self.latency:
+      time.sleep(self.latency)
+    if self.errorRate and random.random() < self.errorRate:
+      raise RuntimeError("Injected error")
+
+  def trending(self, count:int = 30, **kwargs):
+    self._call()
+    return [self.payloads.item('trending', next(self.counter)) for _ in range(count)]
+
+  def userPage(self, userId, secUid, page_size:int = 30, minCursor:int = 0, maxCursor:int = 0, **kwargs):
+    self._call()
+    end = min(self.videosPerUser, maxCursor + page_size)
+    return {'statusCode': 0, 'items': [self.payloads.item(userId, i) for i in range(maxCursor, end)], 'hasMore': end < self.videosPerUser, 'maxCursor': end}
+
+  def byHashtag(self, hashtag:str, count:int = 30, offset:int = 0, **kwargs):
+    self._call()
+    return [self.payloads.legacyItem(hashtag, i) for i in range(offset, offset + count)]
+
+  def getUser(self, username:str, **kwargs):
+    self._call()
+    return {'statusCode': 0, 'userInfo': self.payloads.user(username)}
+
+  def getHashtagObject(self, hashtag:str, **kwargs):
+    self._call()
+    return {'statusCode': 0, 'challengeInfo': {'challenge': {'id': 'id_' + hashtag, 'title': hashtag}, 'shareMeta': {'desc': hashtag}, 'stats': {'videoCount': 1, 'viewCount': 1}}}
+
+  def getTikTokByUrl(self, url:str, **kwargs):
+    self._call()
+    return {'statusCode': 0, 'itemInfo': {'itemStruct': self.payloads.item('url', zlib.crc32(url.encode()) % 10 ** 6)}} # a small index keeps createTime positive
+
+  def discoverHashtags(self, **kwargs):
+    self._call()
+    return [{'cardItem': {'id': str(i), 'title': 'hashtag%d' % i, 'description': '', 'extraInfo': {'views': i}}} for i in range(10)]
+
+  def discoverMusic(self, **kwargs):
+    self._call()
+    return [{'cardItem': {'id': str(i), 'title': 'music%d' % i, 'description': '', 'extraInfo': {'playUrl': '', 'posts': i}}} for i in range(10)]
+
+  def userLiked(self, userId, secUid, count:int = 30, **kwargs):
+    self._call()
+    return [self.payloads.item('liked_' + str(userId), i) for i in range(count)]
+
+  def getSuggestedUsersbyID(self, count:int = 30, userId = None, **kwargs):
+    self._call()
+    return [{'subTitle': '@%s_s%d' % (userId, i)} for i in range(count)]
+
+  def getSuggestedHashtagsbyID(self, count:int = 30, userId = None, **kwargs):
+    self._call()
+    return [{'title': '#%s_h%d' % (userId, i)} for i in range(count)]
+
+  def getSuggestedMusicIDCrawler(self, count:int = 30, userId = None, **kwargs):
+    self._call()
+    return [{'id': '%s_m%d' % (userId, i), 'title': '', 'description': '', 'extraInfo': {}} for i in range(count)]
+
+  def clean_up(self):
+    pass
+
+def installMock(config:dict): # makes `from TikTokApi import TikTokApi` return MockTikTokApi; call before importing mergedTikTokApi
+  MockTikTokApi.payloads = PayloadFactory(cdnUrl=config.get('cdnUrl'), seed=config.get('seed', 0))
+  for name in ('latency', 'errorRate', 'startupSeconds', 'videosPerUser'):
+    if name in config:
+      setattr(MockTikTokApi, name, config[name])
+  module = types.ModuleType('TikTokApi')
+  module.TikTokApi = MockTikTokApi
+  sys.modules['TikTokApi'] = module
+
+#### Local CDN ####
+
+class VideoHandler(BaseHTTPRequestHandler): # answers every GET with videoBytes of filler, honouring "Range: bytes=N-"
+  videoBytes = 4096
+
+  def do_GET(self):
+    body = b'\0' * self.videoBytes
+    start = 0
+    if self.headers.get('Range', '').startswith('bytes='):
+      start = int(self.headers['Range'][6:].split('-')[0] or 0)
+      if start >= len(body):
+        self.send_response(416)
+        self.end_headers()
+        return
+      self.send_response(206)
+      self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(body) - 1, len(body)))
+    else:
+      self.send_response(200)
+    self.send_header('Content-Type', 'video/mp4')
+    self.send_header('Content-Length', str(len(body) - start))
+    self.end_headers()
+    self.wfile.write(body[start:])
+
+  def log_message(self, format, *args):
+    pass
+
+def startCdn(videoBytes:int) -> ThreadingHTTPServer: # serves on a free localhost port from a daemon thread
+  handler = type('Handler', (VideoHandler,), {'videoBytes': videoBytes})
+  server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+  server.daemon_threads = True
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  return server
+
+#### Benchmark Cases ####
+# each case does its untimed setup and returns the timed part, a function returning the number of items it produced
+
+def benchProcessTikTokObject(m, size:int, config:dict):
+  items = [MockTikTokApi.payloads.item('process', i) for i in range(size)]
+  for item in items: # per-item latency, kept out of the throughput run
+    with m.metrics.timer('process_item_seconds'):
+      m.processTikTokObject(item)
+  return lambda: len([m.processTikTokObject(item) for item in items])
+
+def benchRecords(m, size:int, config:dict): # memory held by size processed tiktoks as dicts and as Video records, traced with tracemalloc
+  items = [MockTikTokApi.payloads.item('records', i) for i in range(size)]
+  def retained(records:bool) -> int:
+    tracemalloc.start()
+    try:
+      tiktoks = m.processTikTokObjects(items, records)
+      retainedBytes = tracemalloc.get_traced_memory()[0]
+      del tiktoks
+      return retainedBytes
+    finally:
+      tracemalloc.stop()
+  def run():
+    m.metrics.count('dict_bytes', retained(False))
+    m.metrics.count('record_bytes', retained(True))
+    return size
+  return run
+
+def benchGetTrendingTikToks(m, size:int, config:dict): # with the response cache on, as the cli runs by default
+  def run():
+    m.api.enabled = True
+    try:
+      return len(m.getTrendingTikToks(size))
+    finally:
+      m.api.enabled = False
+  return run
+
+def benchByUsername(m, size:int, config:dict):
+  MockTikTokApi.videosPerUser = size
+  return lambda: len(m.byUsername(['benchuser'], size, errors=[]))
+
+def benchGetSuggestedUsers(m, size:int, config:dict):
+  return lambda: len(m.getSuggestedUsers(['benchuser'], size, errors=[]))
+
+def benchDownloadTikToks(m, size:int, config:dict):
+  tiktoks = [m.processTikTokObject(MockTikTokApi.payloads.item('download%d' % size, i)) for i in range(size)]
+  return lambda: sum(1 for result in m.downloadTikToks(tiktoks) if not result['error'])
+
+def benchMain(m, size:int, config:dict): # runs mergedTikTokApi.main() in a fresh process, so its startup and shutdown are included
+  outFile = 'main%d.json' % size
+  env = dict(os.environ, TIKTOK_BENCHMARK_MOCK = json.dumps(dict(config, videosPerUser = size)))
+  command = [sys.executable, os.path.abspath(__file__), '--runMain', '--function', 'byUsername', '--username', 'benchuser', '--n', str(size), '--outFile', outFile, '--noCache', '--rateLimit', '1000000000']
+  def run():
+    subprocess.run(command, env=env, check=True)
+    with open(outFile) as f:
+      return len(json.load(f))
+  return run
+
+BENCHMARKS = {
+  'processTikTokObject': benchProcessTikTokObject,
+  'records': benchRecords,
+  'getTrendingTikToks': benchGetTrendingTikToks,
+  'byUsername': benchByUsername,
+  'getSuggestedUsers': benchGetSuggestedUsers,
+  'downloadTikToks': benchDownloadTikToks,
+  'main': benchMain,
+}
+
+LATENCY_METRICS = { # histogram whose percentiles are reported for each case
+  'processTikTokObject': 'process_item_seconds',
+  'getTrendingTikToks': 'api_call_seconds{trending}',
+  'byUsername': 'api_call_seconds{userPage}',
+  'getSuggestedUsers': 'api_call_seconds{getUser}',
+  'downloadTikToks': 'download_seconds',
+}
+
+def runBenchmarks(m, cases:list, sizes:list, config:dict) -> list: # one result dict per (case, size)
+  results = []
+  for case in cases:
+    for size in sizes:
+      m.metrics.histograms.clear()
+      m.metrics.counters.clear()
+      m.userCache.clear()
+      run = BENCHMARKS[case](m, size, config)
+      start = time.perf_counter()
+      items = run()
+      seconds = time.perf_counter() - start
+      summary = m.metrics.summary()
+      histogram = summary['histograms'].get(LATENCY_METRICS.get(case), {})
+      results.append({
+        'case': case,
+        'size': size,
+        'items': items,
+        'seconds': seconds,
+        'itemsPerSecond': items / seconds if seconds else None,
+        'p50': histogram.get('p50'),
+        'p95': histogram.get('p95'),
+        'p99': histogram.get('p99'),
+        'errors': sum(value for name, value in summary['counters'].items() if 'errors' in name),
+        'bytes': {name: value for name, value in summary['counters'].items() if name.endswith('_bytes')},
+      })
+      printResult(results[-1])
+  return results
+
+def printResult(result:dict):
+  latency = ' '.join('%s=%.3fms' % (name, result[name] * 1000) for name in ('p50', 'p95', 'p99') if result[name] is not None)
+  memory = ' '.join('%s=%d (%d/item)' % (name, value, value / result['items']) for name, value in result['bytes'].items() if result['items'])
+  print("%-20s %7d items %9.3fs %12.1f items/s  errors=%-5d %s" % (result['case'], result['items'], result['seconds'], result['itemsPerSecond'] or 0, result['errors'], latency or memory))
+
+def main():
+  if sys.argv[1:2] == ['--runMain']: # the main case's child process: the remaining arguments are for mergedTikTokApi.main()
+    installMock(json.loads(os.environ['TIKTOK_BENCHMARK_MOCK']))
+    import mergedTikTokApi
+    sys.argv = [sys.argv[0]] + sys.argv[2:]
+    mergedTikTokApi.main()
+    return
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--cases", nargs='+', choices = CASES, default = CASES)
+  parser.add_argument("--sizes", nargs='+', type=int, default = SIZES)
+  parser.add_argument("--latency", type=float, default=0.0, help="Seconds every mock api call takes")
+  parser.add_argument("--errorRate", type=float, default=0.0, help="Fraction of mock api calls that raise")
+  parser.add_argument("--startupSeconds", type=float, default=0.0, help="Seconds each mock client takes to start")
+  parser.add_argument("--videoBytes", type=int, default=4096, help="Size of every video the local CDN serves")
+  parser.add_argument("--outFile", type=str, required=False, help="Also write the results here as json")
+  args = parser.parse_args()
+
+  cdn = startCdn(args.videoBytes)
+  config = {
+    'cdnUrl': 'http://127.0.0.1:%d' % cdn.server_address[1],
+    'latency': args.latency,
+    'errorRate': args.errorRate,
+    'startupSeconds': args.startupSeconds,
+  }
+  installMock(config)
+  workDir = tempfile.mkdtemp(prefix='tiktokBenchmark')
+  cwd = os.getcwd()
+  os.chdir(workDir) # caches, downloads and outputs all land in the scratch directory
+  try:
+    import mergedTikTokApi as m
+    m.scheduler.rate = 1e9 # measure the code, not the rate limit
+    m.scheduler.baseDelay = 0.01
+    m.api.enabled = False # cases that measure the cache turn it on themselves
+    results = runBenchmarks(m, args.cases, args.sizes, config)
+  finally:
+    os.chdir(cwd)
+    shutil.rmtree(workDir, ignore_errors=True)
+    cdn.shutdown()
+  if args.outFile:
+    with open(args.outFile, 'w') as f:
+      json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+  main()
@@ -1,9 +1,9 @@
 import pprint
 import argparse
-from TikTokApi import TikTokApi
+from tiktokApiPool import TikTokApiPool, PooledApi
 import inspect
 
-api = TikTokApi(debug=True, executablePath="/usr/lib/chromium-browser/chromium-browser")
+api = PooledApi(TikTokApiPool(size=1, debug=True, executablePath="/usr/lib/chromium-browser/chromium-browser")) # browser is started on first use, not at import
 pp = pprint.PrettyPrinter()
 
 #### Aggregate Functions ####
@@ -208,4 +208,5 @@ def main():
       return
     return func(args.username, args.n or default_n, args.printOutput or default_print)
 
-main()
+if __name__ == '__main__':
+  main()
@@ -1,214 +1,374 @@
 import pprint
 import argparse
-from TikTokApi import TikTokApi
+import asyncio
+import weakref
+from tiktokApiPool import TikTokApiPool, PooledApi, ClientStartError, MAX_CLIENTS
+from tiktokDownloader import TikTokDownloader, VideoStore
+from tiktokCache import TTLCache, ResponseCache, CachedApi, SingleFlight
+from tiktokScheduler import RequestScheduler, ScheduledApi
+from tiktokRecords import Video, User, Hashtag, Music, recordToJson
+from tiktokExport import writeParquet
+from tiktokWarehouse import StatsWarehouse
+from tiktokMetrics import Metrics, InstrumentedApi
 import inspect
 import json
 from datetime import datetime
-import requests
 import os
+import queue
+import socketserver
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+try:
+  import numpy as np
+except ImportError: # only needed for the column functions
+  np = None
 
-api = TikTokApi(debug=True, executablePath="/usr/lib/chromium-browser")
+ENDPOINT_TTLS = { # seconds each api response is served from responseCache
+  'trending': 300,
+  'discoverHashtags': 900,
+  'discoverMusic': 900,
+  'byUsername': 600,
+  'byHashtag': 600,
+  'userPage': 600, # getUser and userPage stay at or below userCache's ttl, see main
+  'userLiked': 600,
+  'getUser': 600,
+  'getHashtagObject': 3600,
+  'getTikTokByUrl': 86400,
+  'getSuggestedUsersbyID': 86400,
+  'getSuggestedHashtagsbyID': 86400,
+  'getSuggestedMusicIDCrawler': 86400,
+}
+
+LIVE_ENDPOINTS = ('getUser', 'userPage', 'byHashtag', 'getHashtagObject', 'trending', 'userLiked') # counters and feeds --warehouse and --incremental never read from disk
+
+apiPool = TikTokApiPool(debug=True, executablePath="/usr/lib/chromium-browser") # the one TikTokApi client, started on its own thread on first use, not at import
+responseCache = ResponseCache('tiktokCache/responses.sqlite')
+scheduler = RequestScheduler(rate=2.0, burst=4, maxRetries=3, maxConcurrency=apiPool.size, fatalErrors=(ClientStartError,)) # throttles and retries everything that misses the cache
+metrics = Metrics() # latency histograms and counters, reported by --metrics/--metricsFile
+api = CachedApi(ScheduledApi(InstrumentedApi(PooledApi(apiPool), metrics), scheduler), responseCache, ENDPOINT_TTLS) # api_call_seconds times each attempt that reaches a client
+downloader = TikTokDownloader(workers=8, perHostLimit=4)
+videoStore = VideoStore('downloadedTikToks/store')
+userCache = TTLCache(maxsize=4096, ttl=600) # username -> profile from getUserProfile
+inFlight = SingleFlight() # lets concurrent getUserProfile/hashtagInfoFor calls for the same name share one request
+fanOutOrdered = True # set by --unordered
+fanOutWorkers = 8 # threads fanOut/fanOutStream run items on; their api calls still take turns on the one client, so this overlaps cache hits, parsing and retry backoff
+asyncConcurrency = 32 # blocking calls the async functions run at once, shared across all of them; read when the first one runs
 pp = pprint.PrettyPrinter()
 
 #### Aggregate Functions ####
+# each iterX generator yields records as they arrive; X collects them into a list for printing, downloading and json output.
+# records=True gives Video/User/Hashtag/Music objects (see RECORD_TYPES) built straight from the api responses instead of dicts
 
-def getTrendingTikToks(n:int = 10, printOutput:bool = False, download:bool = False) -> dict: # returns info on n trending tiktoks
-  trendingTiktoks = api.trending(count=n)
-  lst = []
-  for tiktok in trendingTiktoks:
-    resp = processTikTokObject(tiktok)
-    lst.append(resp)
+def iterTrendingTikToks(n:int = 10, records:bool = False):
+  for tiktoks, cursor in pagesTrendingTikToks(n, records=records):
+    yield from tiktoks
+
+def getTrendingTikToks(n:int = 10, printOutput:bool = False, download:bool = False, records:bool = False) -> dict: # returns info on n trending tiktoks
+  lst = list(iterTrendingTikToks(n, records))
   if printOutput:
     pp.pprint(lst)
   if download:
     downloadTikToks(lst)
   return lst
 
-def getTrendingHashtags(n:int = 10, printOutput:bool = False) -> dict: # returns info on hashtags/challenges shown on side of trending page on desktop (up to 10)
+def iterTrendingHashtags(n:int = 10, records:bool = False):
   trendingHashtags = api.discoverHashtags()
-  lst = []
   for i in range(min(n, 10)):
       hashtag = trendingHashtags[i].get('cardItem', {})
       id = hashtag.get('id')
+      if records:
+        yield Hashtag(id, hashtag.get('title'), hashtag.get('description'), None, hashtag.get('extraInfo', {}).get('views'))
+        continue
       resp = {}
       resp['id'] = id
       resp['title'] = hashtag.get('title')
       resp['desc'] = hashtag.get('description')
       resp['views'] = hashtag.get('extraInfo', {}).get('views')
-      lst.append(resp)
+      yield resp
+
+def getTrendingHashtags(n:int = 10, printOutput:bool = False, records:bool = False) -> dict: # returns info on hashtags/challenges shown on side of trending page on desktop (up to 10)
+  lst = list(iterTrendingHashtags(n, records))
   if printOutput:
       pp.pprint(lst)
   return lst
 
-def getTrendingMusic(n:int = 10, printOutput:bool = False) -> dict: # returns info on music shown on side of trending page on desktop
+def iterTrendingMusic(n:int = 10, records:bool = False):
   trendingMusic = api.discoverMusic()
-  lst = []
-  resp = {}
   for i in range(min(n, 10)):
       music = trendingMusic[i].get('cardItem', {})
-      resp = processMusicObject(music)
-      lst.append(resp)
+      yield processMusicObject(music, records)
+
+def getTrendingMusic(n:int = 10, printOutput:bool = False, records:bool = False) -> dict: # returns info on music shown on side of trending page on desktop
+  lst = list(iterTrendingMusic(n, records))
   if printOutput:
       pp.pprint(lst)
   return lst
 
 #### Functions for Individual Objects ####
 
-def getTikTokByUrl(urls, printOutput:bool = False, download:bool = False):
-  lst = []
-  for url in urls:
-    tiktok = api.getTikTokByUrl(url)
-    lst.append(processTikTokObject(tiktok.get('itemInfo', {}).get('itemStruct', {})))
+def iterTikTokByUrl(urls, errors:list = None, records:bool = False):
+  yield from fanOut(lambda url: tiktokForUrl(url, records), urls, errors=errors)
+
+def getTikTokByUrl(urls, printOutput:bool = False, download:bool = False, errors:list = None, records:bool = False):
+  lst = list(iterTikTokByUrl(urls, errors, records))
   if printOutput:
     pp.pprint(lst)
   if download:
     downloadTikToks(lst)
   return lst
 
-def byUsername(usernames, n:int = 10, printOutput:bool = False, download:bool = False) -> dict:
-  lst = []
-  for username in usernames:
-    for tiktok in api.byUsername(username, count=n):
-      lst.append(processTikTokObject(tiktok))
+def iterByUsername(usernames, n:int = 10, errors:list = None, records:bool = False):
+  for tiktoks in fanOut(lambda username: [tiktok for page, cursor in pagesByUsername(username, n, records=records) for tiktok in page], usernames, errors=errors):
+    yield from tiktoks
+
+def byUsername(usernames, n:int = 10, printOutput:bool = False, download:bool = False, errors:list = None, records:bool = False) -> dict:
+  lst = list(iterByUsername(usernames, n, errors, records))
   if printOutput:
     pp.pprint(lst)
   if download:
     downloadTikToks(lst)
   return lst
 
-def byHashtag(hashtags, n:int = 10, printOutput:bool = False, download:bool = False) -> dict:
-  lst = []
-  for hashtag in hashtags:
-    for tiktok in api.byHashtag(hashtag, count=n):
-      resp = {}
-      resp['id'] = tiktok.get('itemInfos', {}).get('id')
-      resp['text'] = tiktok.get('itemInfos', {}).get('text')
-      resp['createTime'] = datetime.fromtimestamp(int(tiktok.get('itemInfos', {}).get('createTime'))).isoformat()
-      resp['playAddr'] = tiktok.get('itemInfos', {}).get('video', {}).get('urls')
-      if resp['playAddr']:
-        resp['playAddr'] = resp['playAddr'][0]
-      resp['username'] = tiktok.get('authorInfos', {}).get('uniqueId')
-      resp['diggCount'] = tiktok.get('itemInfos', {}).get('diggCount')
-      resp['shareCount'] = tiktok.get('itemInfos', {}).get('shareCount')
-      resp['commentCount'] = tiktok.get('itemInfos', {}).get('commentCount')
-      resp['playCount'] = tiktok.get('itemInfos', {}).get('playCount')
-      lst.append(resp)
+def iterByHashtag(hashtags, n:int = 10, errors:list = None, records:bool = False):
+  for tiktoks in fanOut(lambda hashtag: [tiktok for page, cursor in pagesByHashtag(hashtag, n, records=records) for tiktok in page], hashtags, errors=errors):
+    yield from tiktoks
+
+def byHashtag(hashtags, n:int = 10, printOutput:bool = False, download:bool = False, errors:list = None, records:bool = False) -> dict:
+  lst = list(iterByHashtag(hashtags, n, errors, records))
   if printOutput:
     pp.pprint(lst)
   if download:
     downloadTikToks(lst)
   return lst
 
-def getHashtagInfo(hashtags, printOutput:bool = False) -> dict: # returns info for specific hashtag (exclude # symbol from string)
-  lst = []
-  for hashtag in hashtags:
-    resp = {}
-    obj = api.getHashtagObject(hashtag)
-    if (obj.get('statusCode') != 0):
-        print("Error getting object for hashtag: ", hashtag)
-        continue
-    hashtagInfo = obj.get('challengeInfo', {})
-    resp['id'] = hashtagInfo.get('challenge', {}).get('id') 
-    resp['title'] = hashtagInfo.get('challenge', {}).get('title') 
-    resp['desc'] = hashtagInfo.get('shareMeta', {}).get('desc') 
-    resp['videoCount'] = hashtagInfo.get('stats', {}).get('videoCount')
-    resp['viewCount'] = hashtagInfo.get('stats', {}).get('viewCount')
-    lst.append(resp)
+def iterHashtagInfo(hashtags, errors:list = None, records:bool = False):
+  yield from fanOut(lambda hashtag: hashtagInfoFor(hashtag, records), hashtags, errors=errors)
+
+def getHashtagInfo(hashtags, printOutput:bool = False, errors:list = None, records:bool = False) -> dict: # returns info for specific hashtag (exclude # symbol from string)
+  lst = list(iterHashtagInfo(hashtags, errors, records))
   if printOutput:
     pp.pprint(lst)
   return lst
 
-def getUserInfo(usernames: list, printOutput:bool = False) -> dict: # returns info for specific user account
-  lst = []
-  for username in usernames:
-    obj = api.getUser(username)
-    resp = {}
-    if (obj.get('statusCode') != 0):
-        print("Error getting object for username: ", username)
-        continue
-    usernameInfo = obj.get('userInfo', {})
-    resp['id'] = usernameInfo.get('user', {}).get('id')
-    resp['username'] = usernameInfo.get('user', {}).get('uniqueId')
-    resp['verified'] = usernameInfo.get('user', {}).get('verified')
-    resp['followingCount'] = usernameInfo.get('stats', {}).get('followingCount')
-    resp['followerCount'] = usernameInfo.get('stats', {}).get('followerCount')
-    resp['heartCount'] = usernameInfo.get('stats', {}).get('heartCount')
-    resp['videoCount'] = usernameInfo.get('stats', {}).get('videoCount')
-    resp['diggCount'] = usernameInfo.get('stats', {}).get('diggCount')
-    lst.append(resp)
-    if printOutput:
-        pp.pprint(lst)
+def iterUserInfo(usernames: list, errors:list = None, records:bool = False):
+  yield from fanOut(lambda username: userInfoFor(username, records), usernames, errors=errors)
+
+def getUserInfo(usernames: list, printOutput:bool = False, errors:list = None, records:bool = False) -> dict: # returns info for specific user account
+  lst = list(iterUserInfo(usernames, errors, records))
+  if printOutput:
+    pp.pprint(lst)
   return lst
 
-def getUserLikedByUsername(username: str, n:int = 10, printOutput:bool = False, download:bool = False) -> list: # returns list of given user's liked tiktoks (returns 0 if private list)
-  userId = usernameToUserId(username)
-  obj = api.getUser(username)
-  userInfo = obj.get('userInfo', {})
-  likedList = api.userLiked(userId, userInfo.get('user', {}).get('secUid'), count=n)
-  lst = []
-  for tiktok in likedList:
-      resp = processTikTokObject(tiktok)
-      lst.append(resp)
+def iterUserLikedByUsername(username: str, n:int = 10, records:bool = False):
+  profile = getUserProfile(username) or {}
+  for tiktok in api.userLiked(profile.get('id'), profile.get('secUid'), count=n):
+    yield processTikTokObject(tiktok, records)
+
+def getUserLikedByUsername(username: str, n:int = 10, printOutput:bool = False, download:bool = False, records:bool = False) -> list: # returns list of given user's liked tiktoks (returns 0 if private list)
+  lst = list(iterUserLikedByUsername(username, n, records))
   if printOutput:
       pp.pprint(lst)
   if download:
     downloadTikToks(lst)
   return lst
 
-def getSuggestedUsers(usernames:str, n:int = 10, printOutput:bool = False) -> list: # returns list of suggested users given an account. 
-  lst = []
-  for username in usernames:
-    userId = usernameToUserId(username)
-    suggested = api.getSuggestedUsersbyID(count = n, userId = userId)
-    for user in suggested:
-      userN = user.get('subTitle')
-      if userN:
-        userN = userN.replace('@', '')
-        lst += getUserInfo([userN], printOutput)
+def iterSuggestedUsers(usernames:str, n:int = 10, errors:list = None, records:bool = False):
+  # suggestions for every account are gathered first, then each distinct suggested user is looked up once
+  yield from iterUserInfo(suggestedUsernames(usernames, n, errors), errors, records)
+
+def getSuggestedUsers(usernames:str, n:int = 10, printOutput:bool = False, errors:list = None, records:bool = False) -> list: # returns list of suggested users given an account. 
+  lst = list(iterSuggestedUsers(usernames, n, errors, records))
+  if printOutput:
+    pp.pprint(lst)
   return lst
 
-def getSuggestedHashtags(usernames:str, n:int = 10, printOutput:bool = False) -> list: # returns list of suggested hashtags given an account
-  lst = []
-  for username in usernames:
-    userId = usernameToUserId(username)
-    suggested = api.getSuggestedHashtagsbyID(count=n, userId = userId)
-    for hashtag in suggested:
-      hashStr = hashtag.get('title')
-      if hashStr:
-        hashStr = hashStr.replace('#', '')
-        lst += getHashtagInfo([hashStr], printOutput)
+def iterSuggestedHashtags(usernames:str, n:int = 10, errors:list = None, records:bool = False):
+  # suggestions for every account are gathered first, then each distinct suggested hashtag is looked up once
+  yield from iterHashtagInfo(suggestedHashtags(usernames, n, errors), errors, records)
+
+def getSuggestedHashtags(usernames:str, n:int = 10, printOutput:bool = False, errors:list = None, records:bool = False) -> list: # returns list of suggested hashtags given an account
+  lst = list(iterSuggestedHashtags(usernames, n, errors, records))
+  if printOutput:
+    pp.pprint(lst)
   return lst
 
-def getSuggestedMusic(usernames:str, n:int = 10, printOutput:bool = False) -> list: # returns list of suggested music given an account
-  lst = []
+def iterSuggestedMusic(usernames:str, n:int = 10, records:bool = False):
   for username in usernames:
     userId = usernameToUserId(username)
-    suggested = api.getSuggestedMusicIDCrawler(count = n, userId = userId)
-    for music in suggested:
-        resp = processMusicObject(music)
-        lst.append(resp)
+    for music in api.getSuggestedMusicIDCrawler(count = n, userId = userId):
+      yield processMusicObject(music, records)
+
+def getSuggestedMusic(usernames:str, n:int = 10, printOutput:bool = False, records:bool = False) -> list: # returns list of suggested music given an account
+  lst = list(iterSuggestedMusic(usernames, n, records))
   if printOutput:
     pp.pprint(lst)
   return lst
 
+#### Record Functions ####
+
+RECORD_TYPES = { # record class each function builds when called with records=True
+  'getTrendingTikToks': Video,
+  'getTrendingHashtags': Hashtag,
+  'getTrendingMusic': Music,
+  'getHashtagInfo': Hashtag,
+  'getUserInfo': User,
+  'getUserLikedByUsername': Video,
+  'getSuggestedUsers': User,
+  'getSuggestedHashtags': Hashtag,
+  'getSuggestedMusic': Music,
+  'byUsername': Video,
+  'byHashtag': Video,
+  'getTikTokByUrl': Video,
+}
+
+#### Column Functions ####
+# same tiktoks as getTrendingTikToks/byUsername, but as numpy columns from normalizeTikToks, with no per-record dicts
+
+def getTrendingTikTokColumns(n:int = 10) -> dict:
+  return normalizeTikToks([tiktok for tiktoks, cursor in pagesTrendingTikToks(n, raw=True) for tiktok in tiktoks])
+
+def byUsernameColumns(usernames, n:int = 10, errors:list = None) -> dict:
+  pages = fanOut(lambda username: [tiktok for page, cursor in pagesByUsername(username, n, raw=True) for tiktok in page], usernames, errors=errors)
+  return normalizeTikToks([tiktok for tiktoks in pages for tiktok in tiktoks])
+
+#### Pagers ####
+# each pagesX generator yields (tiktoks, cursor) one page at a time, stopping after n tiktoks or at the end of the feed.
+# Passing a yielded cursor back in resumes right after that page, so callers can stop early and checkpoint.
+# raw=True skips processTikTokObjects and yields the items as the api returned them, records=True yields Video records
+
+def pagesTrendingTikToks(n:int = 10, pageSize:int = 30, cursor:int = 0, raw:bool = False, records:bool = False): # cursor counts tiktoks already yielded
+  # the trending feed has no server cursor, so one api.trending(count=n) call is sliced into pages. Repeating that call
+  # would be answered by responseCache, and a resumed crawl gets the same cached list back to skip into
+  if cursor >= n:
+    return
+  unique = {}
+  for tiktok in api.trending(count=n):
+    unique.setdefault(tiktok.get('id'), tiktok)
+  items = list(unique.values())[:n]
+  for start in range(cursor, len(items), pageSize):
+    page = items[start:start + pageSize]
+    yield (page if raw else processTikTokObjects(page, records)), start + len(page)
+
+def pagesByUsername(username: str, n:int = 10, pageSize:int = 30, cursor:int = 0, raw:bool = False, records:bool = False): # cursor is the feed's maxCursor
+  profile = getUserProfile(username)
+  if not profile:
+    raise LookupError("Error getting object for username: " + username)
+  remaining = n
+  while remaining > 0:
+    resp = api.userPage(profile['id'], profile['secUid'], page_size=min(pageSize, remaining), maxCursor=cursor)
+    items = resp.get('items') or []
+    cursor = resp.get('maxCursor', cursor)
+    tiktoks = items[:remaining] if raw else processTikTokObjects(items[:remaining], records)
+    remaining -= len(tiktoks)
+    yield tiktoks, cursor
+    if not items or not resp.get('hasMore'):
+      return
+
+def pagesByHashtag(hashtag: str, n:int = 10, pageSize:int = 30, cursor:int = 0, raw:bool = False, records:bool = False): # cursor is the offset into the hashtag's feed
+  # TikTokApi's byHashtag looks the challenge up again on every call, out of sight of the scheduler and cache, so the feed up
+  # to cursor + n comes from one call and is sliced into pages, like the trending feed. A resumed crawl asks for the same
+  # cursor + n and gets it from responseCache
+  if n <= 0:
+    return
+  items = api.byHashtag(hashtag, count=cursor + n)[cursor:cursor + n]
+  for start in range(0, len(items), pageSize):
+    page = items[start:start + pageSize]
+    yield (page if raw else processTikTokObjects(page, records)), cursor + start + len(page)
+
 #### Util Functions ####
 
-def processTikTokObject(tiktok:dict) -> dict:
-  id = tiktok['id']
-  resp = {}
-  resp['id'] = id
-  resp['desc'] = tiktok.get('desc')
-  resp['createTime'] = datetime.fromtimestamp(int(tiktok.get('createTime'))).isoformat()
-  resp['playAddr'] = tiktok.get('video', {}).get('playAddr')
-  resp['username'] = tiktok.get('author', {}).get('uniqueId')
-  resp['diggCount'] = tiktok.get('stats', {}).get('diggCount')
-  resp['shareCount'] = tiktok.get('stats', {}).get('shareCount')
-  resp['commentCount'] = tiktok.get('stats', {}).get('commentCount')
-  resp['playCount'] = tiktok.get('stats', {}).get('playCount')
-  return resp
+def videoDict(id, desc, createTime, playAddr, username, diggCount, shareCount, commentCount, playCount) -> dict: # processTikTokObject's dict, with the fields of Video
+  return {'id': id, 'desc': desc, 'createTime': createTime, 'playAddr': playAddr, 'username': username, 'diggCount': diggCount, 'shareCount': shareCount, 'commentCount': commentCount, 'playCount': playCount}
+
+def extractTikTok(tiktok:dict, make = videoDict): # the current itemStruct shape; make is videoDict or Video
+  video = tiktok.get('video', {})
+  stats = tiktok.get('stats', {})
+  return make(
+    tiktok['id'],
+    tiktok.get('desc'),
+    datetime.fromtimestamp(int(tiktok.get('createTime'))).isoformat(),
+    video.get('playAddr'),
+    tiktok.get('author', {}).get('uniqueId'),
+    stats.get('diggCount'),
+    stats.get('shareCount'),
+    stats.get('commentCount'),
+    stats.get('playCount'),
+  )
 
-def processMusicObject(music:dict) -> dict:
+def extractLegacyTikTok(tiktok:dict, make = videoDict): # the older itemInfos/authorInfos shape byHashtag still returns
+  info = tiktok.get('itemInfos', {})
+  urls = info.get('video', {}).get('urls')
+  return make(
+    info['id'],
+    info.get('text'),
+    datetime.fromtimestamp(int(info.get('createTime'))).isoformat(),
+    urls[0] if urls else None,
+    tiktok.get('authorInfos', {}).get('uniqueId'),
+    info.get('diggCount'),
+    info.get('shareCount'),
+    info.get('commentCount'),
+    info.get('playCount'),
+  )
+
+TIKTOK_EXTRACTORS = { # payload shape -> function producing processTikTokObject's dict or record
+  'itemStruct': extractTikTok,
+  'itemInfos': extractLegacyTikTok,
+}
+
+def tiktokShape(tiktok:dict) -> str:
+  return 'itemInfos' if 'itemInfos' in tiktok else 'itemStruct'
+
+def processTikTokObject(tiktok:dict, records:bool = False) -> dict: # a Video instead of the dict with records=True
+  return TIKTOK_EXTRACTORS[tiktokShape(tiktok)](tiktok, Video if records else videoDict)
+
+@metrics.timed('process_seconds')
+def processTikTokObjects(tiktoks:list, records:bool = False) -> list: # same as processTikTokObject on each item, detecting the payload shape once per response
+  if not tiktoks:
+    return []
+  extract = TIKTOK_EXTRACTORS[tiktokShape(tiktoks[0])]
+  make = Video if records else videoDict
+  return [extract(tiktok, make) for tiktok in tiktoks]
+
+def normalizeTikToks(tiktoks:list) -> dict: # batch version of processTikTokObject returning one numpy array per field
+  # counters and createTime are int64 (missing counters become 0), createdAt is createTime converted to UTC datetime64[s] in one step
+  if np is None:
+    raise ImportError("normalizeTikToks needs numpy (pip install numpy)")
+  ids, descs, createTimes, playAddrs, usernames = [], [], [], [], []
+  counts = {'diggCount': [], 'shareCount': [], 'commentCount': [], 'playCount': []}
+  for tiktok in tiktoks: # either payload shape, see TIKTOK_EXTRACTORS
+    if tiktokShape(tiktok) == 'itemInfos':
+      stats = tiktok.get('itemInfos') or {} # the legacy shape keeps its counters next to the other fields
+      urls = (stats.get('video') or {}).get('urls')
+      ids.append(stats['id'])
+      descs.append(stats.get('text'))
+      playAddrs.append(urls[0] if urls else None)
+      usernames.append((tiktok.get('authorInfos') or {}).get('uniqueId'))
+    else:
+      stats = tiktok.get('stats') or {}
+      ids.append(tiktok['id'])
+      descs.append(tiktok.get('desc'))
+      playAddrs.append((tiktok.get('video') or {}).get('playAddr'))
+      usernames.append((tiktok.get('author') or {}).get('uniqueId'))
+    createTimes.append(createTimeOf(tiktok))
+    for name, column in counts.items():
+      column.append(stats.get(name) or 0)
+  columns = {
+    'id': np.array(ids, dtype=str),
+    'desc': np.array(descs, dtype=object),
+    'createTime': np.array(createTimes, dtype=np.int64),
+    'playAddr': np.array(playAddrs, dtype=object),
+    'username': np.array(usernames, dtype=object),
+  }
+  columns['createdAt'] = columns['createTime'].astype('datetime64[s]')
+  for name, column in counts.items():
+    columns[name] = np.array(column, dtype=np.int64)
+  return columns
+
+def processMusicObject(music:dict, records:bool = False) -> dict:
   id = music.get('id')
+  if records:
+    return Music(id, music.get('title'), music.get('description'), music.get('extraInfo', {}).get('playUrl'), music.get('extraInfo', {}).get('posts'))
   resp = {}
   resp['id'] = id
   resp['title'] = music.get('title')
@@ -217,27 +377,640 @@ def processMusicObject(music:dict) -> dict:
   resp['videoCount'] = music.get('extraInfo', {}).get('posts')
   return resp
 
-def usernameToUserId(username: str) -> str:
+def tiktokForUrl(url: str, records:bool = False) -> dict:
+  tiktok = api.getTikTokByUrl(url)
+  return processTikTokObject(tiktok.get('itemInfo', {}).get('itemStruct', {}), records)
+
+def hashtagInfoFor(hashtag: str, records:bool = False) -> dict:
+  shared = inFlight.do(('hashtag', hashtag), fetchHashtagInfo, hashtag)
+  return Hashtag.fromDict(shared) if records else dict(shared) # each caller gets its own copy of a shared result
+
+def fetchHashtagInfo(hashtag: str) -> dict:
+  obj = api.getHashtagObject(hashtag)
+  if (obj.get('statusCode') != 0):
+    raise LookupError("Error getting object for hashtag: " + hashtag)
+  hashtagInfo = obj.get('challengeInfo', {})
+  resp = {}
+  resp['id'] = hashtagInfo.get('challenge', {}).get('id') 
+  resp['title'] = hashtagInfo.get('challenge', {}).get('title') 
+  resp['desc'] = hashtagInfo.get('shareMeta', {}).get('desc') 
+  resp['videoCount'] = hashtagInfo.get('stats', {}).get('videoCount')
+  resp['viewCount'] = hashtagInfo.get('stats', {}).get('viewCount')
+  return resp
+
+def userInfoFor(username: str, records:bool = False) -> dict:
+  profile = getUserProfile(username)
+  if not profile:
+    raise LookupError("Error getting object for username: " + username)
+  if records:
+    stats = profile['stats']
+    return User(profile['id'], profile['username'], profile['verified'], stats.get('followingCount'), stats.get('followerCount'), stats.get('heartCount'), stats.get('videoCount'), stats.get('diggCount'))
+  resp = {}
+  resp['id'] = profile['id']
+  resp['username'] = profile['username']
+  resp['verified'] = profile['verified']
+  resp['followingCount'] = profile['stats'].get('followingCount')
+  resp['followerCount'] = profile['stats'].get('followerCount')
+  resp['heartCount'] = profile['stats'].get('heartCount')
+  resp['videoCount'] = profile['stats'].get('videoCount')
+  resp['diggCount'] = profile['stats'].get('diggCount')
+  return resp
+
+def suggestedUsernames(usernames, n:int = 10, errors:list = None) -> list: # distinct usernames suggested for any of the given accounts, in first-seen order
+  suggestedLists = fanOut(lambda username: api.getSuggestedUsersbyID(count = n, userId = usernameToUserId(username)), usernames, errors=errors)
+  userNs = [user.get('subTitle').replace('@', '') for suggested in suggestedLists for user in suggested if user.get('subTitle')]
+  return list(dict.fromkeys(userNs))
+
+def suggestedHashtags(usernames, n:int = 10, errors:list = None) -> list: # distinct hashtags suggested for any of the given accounts, in first-seen order
+  suggestedLists = fanOut(lambda username: api.getSuggestedHashtagsbyID(count = n, userId = usernameToUserId(username)), usernames, errors=errors)
+  hashStrs = [hashtag.get('title').replace('#', '') for suggested in suggestedLists for hashtag in suggested if hashtag.get('title')]
+  return list(dict.fromkeys(hashStrs))
+
+def getUserProfile(username: str) -> dict: # returns id, secUid and stats for a user (None if the lookup failed), served from userCache when possible
+  profile = userCache.get(username)
+  if profile is None:
+    profile = inFlight.do(('user', username), fetchUserProfile, username)
+  return profile
+
+def fetchUserProfile(username: str) -> dict:
+  profile = userCache.peek(username) # a request for the same user may have finished since the caller checked
+  if profile is not None:
+    return profile
   obj = api.getUser(username)
+  if (obj.get('statusCode') != 0):
+    return None
   userInfo = obj.get('userInfo', {})
-  userId = userInfo.get('user', {}).get('id')
-  return userId
+  user = userInfo.get('user', {})
+  profile = {
+    'id': user.get('id'),
+    'secUid': user.get('secUid'),
+    'username': user.get('uniqueId'),
+    'verified': user.get('verified'),
+    'stats': userInfo.get('stats', {}),
+  }
+  userCache.set(username, profile)
+  return profile
 
-def downloadTikToks(tiktoks):
-  dirName = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+def usernameToUserId(username: str) -> str:
+  profile = getUserProfile(username)
+  return profile['id'] if profile else None
+
+def fanOut(fn, items, workers:int = None, errors:list = None, ordered:bool = None): # runs fn(item) for every item on a thread pool, yielding results
+  # results come back in input order unless ordered=False, then as they complete. A failing item is
+  # appended to errors as {'input', 'error'} (or printed when no list is given) and yields nothing.
+  # ClientStartError is raised instead, since no item can succeed without the api client
+  items = list(items or [])
+  if not items:
+    return
+  ordered = fanOutOrdered if ordered is None else ordered
+  with ThreadPoolExecutor(max_workers=min(workers or fanOutWorkers, len(items))) as executor:
+    futures = {executor.submit(fn, item): item for item in items}
+    for future in (futures if ordered else as_completed(futures)):
+      try:
+        yield future.result()
+      except ClientStartError:
+        for pending in futures:
+          pending.cancel()
+        raise
+      except Exception as e:
+        if errors is None:
+          print("Error for input: ", futures[future], e)
+        else:
+          errors.append({'input': futures[future], 'error': str(e)})
+
+STREAM_DONE = object() # yielded by fanOutStream once an item's iterator is exhausted
+
+def fanOutStream(fn, items, workers:int = None, errors:list = None): # like fanOut, but fn(item) returns an iterator and each value is yielded as (item, value) as soon as a worker produces it
+  # (item, STREAM_DONE) follows an item's last value; a failing item is recorded in errors and never gets one,
+  # except for ClientStartError, which is raised like in fanOut
+  items = list(items or [])
+  if not items:
+    return
+  workers = min(workers or fanOutWorkers, len(items))
+  results = queue.Queue(maxsize=workers * 2) # bounded, so workers wait for a slow consumer instead of piling up pages
+  stop = threading.Event()
+  def put(entry):
+    while not stop.is_set():
+      try:
+        results.put(entry, timeout=0.1)
+        return
+      except queue.Full:
+        pass
+  def run(item):
+    try:
+      for value in fn(item):
+        if stop.is_set():
+          return
+        put((item, value, None))
+      put((item, STREAM_DONE, None))
+    except Exception as e:
+      put((item, None, e))
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    futures = [executor.submit(run, item) for item in items]
+    try:
+      finished = 0
+      while finished < len(items):
+        item, value, error = results.get()
+        if isinstance(error, ClientStartError):
+          raise error
+        if error is not None or value is STREAM_DONE:
+          finished += 1
+        if error is None:
+          yield item, value
+        elif errors is None:
+          print("Error for input: ", item, error)
+        else:
+          errors.append({'input': item, 'error': str(error)})
+    finally:
+      stop.set()
+      for future in futures:
+        future.cancel()
+
+def downloadTikToks(tiktoks, dirName:str = None) -> list: # downloads videos not already in videoStore, returns one result per tiktok with a playAddr
+  # each run's timestamped directory only holds hardlinks into the store
+  dirName = dirName or datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+  lst = []
+  jobs = []
+  queued = set()
   for tiktok in tiktoks:
     addr = tiktok['playAddr']
-    id = tiktok['id']
-    path = 'downloadedTikToks/' + dirName + '/' + str(id) + '.mp4'
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    r = requests.get(addr, headers={'referer': 'https://www.tiktok.com/'})
-    open(path, 'wb').write(r.content)
+    id = str(tiktok['id'])
+    if not addr:
+      print("No playAddr for tiktok: ", id)
+      continue
+    resp = {'id': id, 'url': addr, 'path': 'downloadedTikToks/' + dirName + '/' + id + '.mp4', 'bytes': 0, 'cached': videoStore.has(id), 'error': None}
+    if not resp['cached'] and id not in queued:
+      queued.add(id)
+      jobs.append((id, addr))
+    lst.append(resp)
+  results = downloader.downloadAll([(addr, videoStore.pathFor(id)) for id, addr in jobs])
+  fetched = {}
+  for (id, addr), result in zip(jobs, results):
+    metrics.observe('download_seconds', result['seconds'])
+    metrics.count('download_bytes', result['bytes'])
+    metrics.count('download_errors' if result['error'] else 'downloads')
+    if not result['error']:
+      videoStore.add(id, result)
+    fetched[id] = result
+  videoStore.save()
+  for resp in lst:
+    result = fetched.get(resp['id'])
+    if result:
+      resp['bytes'] = result.pop('bytes', 0) # only counted for the first occurrence of a repeated id
+      resp['error'] = result['error']
+    if not resp['error']:
+      videoStore.link(resp['id'], resp['path'])
+  return lst
     
 def viewTikTokByAddr(addr:str):
-  r = requests.get(addr, headers={'referer': 'https://www.tiktok.com/'})
+  r = downloader.session.get(addr)
   print(r.__dict__)
   
 
+#### Checkpointing ####
+
+class CrawlJournal: # append-only json lines log of page cursors and finished inputs, read back by --resume
+  def __init__(self, path:str, resume:bool = False):
+    self.path = path
+    self.done = set()
+    self.cursors = {}
+    self.counts = {}
+    if resume and os.path.exists(path):
+      with open(path) as f:
+        for line in f:
+          try:
+            self._apply(json.loads(line))
+          except ValueError: # last line was cut off mid-write
+            pass
+    self._file = open(path, 'a' if resume else 'w')
+
+  def page(self, key:str, cursor, count:int): # call after the page's records have been written out
+    self._write({'input': key, 'cursor': cursor, 'count': count})
+
+  def finish(self, key:str):
+    self._write({'input': key, 'done': True})
+
+  def close(self):
+    self._file.close()
+
+  def _write(self, entry:dict):
+    self._file.write(json.dumps(entry) + '\n')
+    self._file.flush()
+    self._apply(entry)
+
+  def _apply(self, entry:dict):
+    key = entry['input']
+    if entry.get('done'):
+      self.done.add(key)
+    else:
+      self.cursors[key] = entry['cursor']
+      self.counts[key] = self.counts.get(key, 0) + entry['count']
+
+def iterCheckpointed(function:str, fnArgs:list, journal:CrawlJournal, errors:list = None): # yields the same records as ITER_MAP[function](*fnArgs), journaling every page so --resume skips finished work
+  # a page is journaled only once the consumer asks for the next record, i.e. after it has written the page out
+  inputs = fnArgs[0]
+  if function == 'getTrendingTikToks':
+    inputs, n = ['trending'], fnArgs[0]
+    pages = lambda key: pagesTrendingTikToks(n, cursor=journal.counts.get(key, 0))
+  elif function == 'byUsername':
+    n = fnArgs[1]
+    pages = lambda username: pagesByUsername(username, n - journal.counts.get(username, 0), cursor=journal.cursors.get(username, 0))
+  elif function == 'byHashtag':
+    n = fnArgs[1]
+    pages = lambda hashtag: pagesByHashtag(hashtag, n - journal.counts.get(hashtag, 0), cursor=journal.cursors.get(hashtag, 0))
+  else: # one record per input
+    if function == 'getSuggestedUsers':
+      inputs, lookup = suggestedUsernames(inputs, fnArgs[1], errors), userInfoFor
+    elif function == 'getSuggestedHashtags':
+      inputs, lookup = suggestedHashtags(inputs, fnArgs[1], errors), hashtagInfoFor
+    else:
+      lookup = {'getUserInfo': userInfoFor, 'getHashtagInfo': hashtagInfoFor, 'getTikTokByUrl': tiktokForUrl}[function]
+    pages = lambda key: iter([([lookup(key)], None)])
+  keys = [key for key in dict.fromkeys(inputs) if key not in journal.done]
+  def run(key): # a failure comes back through the stream, so ordered output never waits on an input that won't finish
+    try:
+      yield from pages(key)
+    except Exception as e:
+      yield e
+  stream = fanOutStream(run, keys)
+  failed = set()
+  for key, page in (inInputOrder(stream, keys) if fanOutOrdered else stream):
+    if isinstance(page, ClientStartError):
+      raise page
+    if isinstance(page, Exception):
+      failed.add(key)
+      if errors is None:
+        print("Error for input: ", key, page)
+      else:
+        errors.append({'input': key, 'error': str(page)})
+      continue
+    if page is STREAM_DONE:
+      if key not in failed:
+        journal.finish(key)
+      continue
+    records, cursor = page
+    yield from records
+    journal.page(key, cursor, len(records))
+
+def inInputOrder(stream, keys:list): # reorders fanOutStream's (key, value) pairs into key order; the earliest unfinished key streams live, later ones are held until it is done
+  pending = {key: [] for key in keys}
+  position = 0
+  for key, value in stream:
+    if key != keys[position]:
+      pending[key].append(value)
+      continue
+    yield key, value
+    while value is STREAM_DONE and position + 1 < len(keys):
+      position += 1
+      value = None
+      for value in pending.pop(keys[position]):
+        yield keys[position], value
+
+#### Incremental Crawls ####
+
+class DeltaState: # newest createTime seen per feed ('user:<username>' or 'hashtag:<hashtag>'), kept in a json file between runs
+  def __init__(self, path:str = 'tiktokCrawlState.json'):
+    self.path = path
+    self.watermarks = {}
+    if os.path.exists(path):
+      with open(path) as f:
+        self.watermarks = json.load(f)
+
+  def watermark(self, key:str) -> int:
+    return self.watermarks.get(key, 0)
+
+  def advance(self, key:str, createTime:int):
+    self.watermarks[key] = max(createTime, self.watermark(key))
+
+  def save(self):
+    with open(self.path + '.part', 'w') as f:
+      json.dump(self.watermarks, f)
+    os.replace(self.path + '.part', self.path)
+
+def iterIncremental(kind:str, names, n:int, state:DeltaState, errors:list = None): # like iterByUsername/iterByHashtag ('user'/'hashtag') but only yields tiktoks newer than the feed's watermark
+  # user feeds are newest first apart from up to 3 pinned videos, so paging stops once more than 3 already-seen
+  # videos turn up. Hashtag feeds are ranked, not chronological, so paging stops at the first page with nothing new.
+  # Watermarks advance as each feed's tiktoks are consumed; call state.save() once the output is safely written
+  def newTikToks(name):
+    key = kind + ':' + name
+    watermark = state.watermark(key)
+    pages = pagesByUsername(name, n, raw=True) if kind == 'user' else pagesByHashtag(name, n, raw=True)
+    fresh = []
+    seen = 0
+    for items, cursor in pages:
+      newItems = [item for item in items if createTimeOf(item) > watermark]
+      fresh += newItems
+      seen += len(items) - len(newItems)
+      if (kind == 'user' and seen > 3) or (kind == 'hashtag' and not newItems):
+        break
+    pages.close()
+    newest = max([createTimeOf(item) for item in fresh], default=watermark)
+    return key, newest, processTikTokObjects(fresh)
+  for key, newest, tiktoks in fanOut(newTikToks, names, errors=errors):
+    yield from tiktoks
+    state.advance(key, newest)
+
+def createTimeOf(tiktok:dict) -> int: # from a raw item in either the current or the legacy itemInfos shape
+  return int(tiktok.get('createTime') or tiktok.get('itemInfos', {}).get('createTime') or 0)
+
+#### Graph Crawl ####
+
+def iterSuggestedUserGraph(usernames, n:int = 10, depth:int = 2, maxUsers:int = 1000, errors:list = None):
+  # breadth-first over getSuggestedUsersbyID from the seed accounts, one level at a time with each level's lookups fanned out.
+  # Yields ('node', userInfo) for every account reached (userInfo gets its 'depth') and ('edge', (username, suggested)) for
+  # every suggestion. Each account is looked up once; after maxUsers accounts no new ones are queued, so edges to them are dropped.
+  # An edge is only yielded once its target's node has been, so a failed lookup leaves no edges pointing at a missing node
+  visited = set()
+  nodes = set() # accounts whose lookup succeeded
+  held = {} # target -> sources whose edges wait for the target's node
+  frontier = []
+  for username in usernames:
+    if username not in visited and len(visited) < maxUsers:
+      visited.add(username)
+      frontier.append(username)
+  def visit(username, expand):
+    info = userInfoFor(username)
+    suggested = []
+    if expand:
+      suggested = [user.get('subTitle').replace('@', '') for user in api.getSuggestedUsersbyID(count = n, userId = info['id']) if user.get('subTitle')]
+    return info, suggested
+  level = 0
+  while frontier:
+    expand = level < depth
+    nextFrontier = []
+    for username, (info, suggested) in fanOut(lambda username: (username, visit(username, expand)), frontier, errors=errors):
+      info['depth'] = level
+      nodes.add(username)
+      yield 'node', info
+      for source in held.pop(username, []):
+        yield 'edge', (source, username)
+      for target in dict.fromkeys(suggested):
+        if target not in visited and len(visited) < maxUsers:
+          visited.add(target)
+          nextFrontier.append(target)
+        if target in nodes:
+          yield 'edge', (username, target)
+        elif target in visited:
+          held.setdefault(target, []).append(username)
+    frontier = nextFrontier
+    level += 1
+
+def iterCrawlSuggestedUsers(usernames, n:int = 10, depth:int = 2, maxUsers:int = 1000, errors:list = None): # the graph as flat records for ndjson: nodes get 'type': 'node', edges are {'type': 'edge', 'source', 'target'}
+  for kind, value in iterSuggestedUserGraph(usernames, n, depth, maxUsers, errors):
+    yield dict(value, type='node') if kind == 'node' else {'type': 'edge', 'source': value[0], 'target': value[1]}
+
+def crawlSuggestedUsers(usernames, n:int = 10, depth:int = 2, maxUsers:int = 1000, printOutput:bool = False, errors:list = None) -> dict: # returns {'nodes': [userInfo], 'edges': [[username, suggested]]} for the suggested-users graph around the given accounts
+  graph = {'nodes': [], 'edges': []}
+  for kind, value in iterSuggestedUserGraph(usernames, n, depth, maxUsers, errors):
+    graph[kind + 's'].append(value if kind == 'node' else list(value))
+  if printOutput:
+    pp.pprint(graph)
+  return graph
+
+#### Async Functions ####
+# TikTokApi is synchronous, so these run the same blocking lookups on one shared thread pool, one call per input,
+# behind a per-event-loop semaphore. The single api client and the scheduler still bound how much of that reaches the browser
+
+asyncExecutor = None
+asyncSemaphores = weakref.WeakKeyDictionary() # event loop -> semaphore of asyncConcurrency slots
+
+async def runBlocking(fn, *args):
+  global asyncExecutor
+  loop = asyncio.get_running_loop()
+  if asyncExecutor is None:
+    asyncExecutor = ThreadPoolExecutor(max_workers=asyncConcurrency)
+  if loop not in asyncSemaphores:
+    asyncSemaphores[loop] = asyncio.Semaphore(asyncConcurrency)
+  async with asyncSemaphores[loop]:
+    return await loop.run_in_executor(asyncExecutor, lambda: fn(*args))
+
+async def asyncFanOut(fn, items, errors:list = None) -> list: # awaitable fanOut: results in input order, failures recorded like fanOut's
+  items = list(items or [])
+  results = await asyncio.gather(*[runBlocking(fn, item) for item in items], return_exceptions=True)
+  lst = []
+  for item, result in zip(items, results):
+    if isinstance(result, ClientStartError): # not the item's fault, see fanOut
+      raise result
+    if not isinstance(result, Exception):
+      lst.append(result)
+    elif errors is None:
+      print("Error for input: ", item, result)
+    else:
+      errors.append({'input': item, 'error': str(result)})
+  return lst
+
+async def asyncGetTrendingTikToks(n:int = 10) -> list:
+  return await runBlocking(lambda n: list(iterTrendingTikToks(n)), n)
+
+async def asyncGetUserInfo(usernames, errors:list = None) -> list:
+  return await asyncFanOut(userInfoFor, usernames, errors)
+
+async def asyncGetHashtagInfo(hashtags, errors:list = None) -> list:
+  return await asyncFanOut(hashtagInfoFor, hashtags, errors)
+
+async def asyncByUsername(usernames, n:int = 10, errors:list = None) -> list:
+  pages = await asyncFanOut(lambda username: [tiktok for page, cursor in pagesByUsername(username, n) for tiktok in page], usernames, errors)
+  return [tiktok for tiktoks in pages for tiktok in tiktoks]
+
+async def asyncByHashtag(hashtags, n:int = 10, errors:list = None) -> list:
+  pages = await asyncFanOut(lambda hashtag: [tiktok for page, cursor in pagesByHashtag(hashtag, n) for tiktok in page], hashtags, errors)
+  return [tiktok for tiktoks in pages for tiktok in tiktoks]
+
+async def asyncGetTikTokByUrl(urls, errors:list = None) -> list:
+  return await asyncFanOut(tiktokForUrl, urls, errors)
+
+async def asyncDownloadTikToks(tiktoks, dirName:str = None) -> list: # the downloader's own workers fetch the videos; this only waits for them
+  return await runBlocking(downloadTikToks, tiktoks, dirName)
+
+#### Service Mode ####
+# --serve keeps one process, and so its warm client, caches and connection pools, answering requests:
+#   POST /<function> with the function's keyword arguments as a json object, e.g. POST /byUsername {"usernames": ["a"], "n": 30}
+#   GET /functions, GET /health, GET /metrics (Prometheus text)
+
+class ServiceHandler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1' # keep-alive, so clients can reuse their connection
+  functions = {}
+
+  def do_GET(self):
+    if self.path == '/functions':
+      self.reply(200, {name: [param for param in inspect.signature(function).parameters if param != 'errors'] for name, function in self.functions.items()})
+    elif self.path == '/health':
+      self.reply(200, {'pool': apiPool.stats(), 'scheduler': scheduler.stats(), 'responseCache': responseCache.stats(), 'userCache': userCache.stats(), 'coalesced': inFlight.shared})
+    elif self.path == '/metrics':
+      self.reply(200, metrics.toPrometheus(), 'text/plain; version=0.0.4')
+    else:
+      self.reply(404, {'error': "Unknown path: " + self.path})
+
+  def do_POST(self):
+    function = self.functions.get(self.path.strip('/'))
+    if function is None:
+      self.reply(404, {'error': "Unknown function: " + self.path.strip('/')})
+      return
+    errors = [] # per-input failures, returned next to the result
+    try:
+      kwargs = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+      if not isinstance(kwargs, dict):
+        raise TypeError("Request body must be a json object of keyword arguments")
+      for name in ('usernames', 'hashtags', 'urls'): # a single name is as good as a list of one
+        if isinstance(kwargs.get(name), str):
+          kwargs[name] = [kwargs[name]]
+      if 'errors' in inspect.signature(function).parameters:
+        kwargs['errors'] = errors
+      inspect.signature(function).bind(**kwargs)
+    except (ValueError, TypeError) as e:
+      self.reply(400, {'error': str(e)})
+      return
+    try:
+      result = function(**kwargs)
+    except ClientStartError as e:
+      self.reply(503, {'error': str(e), 'errors': errors})
+      return
+    except Exception as e:
+      self.reply(500, {'error': str(e), 'errors': errors})
+      return
+    self.reply(200, {'result': result, 'errors': errors})
+
+  def reply(self, status:int, body, contentType:str = 'application/json'):
+    data = (body if isinstance(body, str) else json.dumps(body, default=recordToJson)).encode()
+    self.send_response(status)
+    self.send_header('Content-Type', contentType)
+    self.send_header('Content-Length', str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def address_string(self) -> str:
+    return self.client_address[0] if self.client_address else 'unix socket'
+
+class UnixServiceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  daemon_threads = True
+
+def serve(functions:dict, host:str = '127.0.0.1', port:int = 8765, socketPath:str = None): # answers requests until interrupted, each on its own thread
+  handler = type('Handler', (ServiceHandler,), {'functions': functions})
+  if socketPath:
+    if os.path.exists(socketPath):
+      os.remove(socketPath)
+    server = UnixServiceServer(socketPath, handler)
+  else:
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+  try:
+    apiPool.warm() # the one client; handler threads all send their calls to its thread
+  except ClientStartError as e: # the next request that needs the api tries again
+    print(e)
+  print("Serving", ', '.join(functions), "on", socketPath or 'http://%s:%d' % (host, port))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    if socketPath and os.path.exists(socketPath):
+      os.remove(socketPath)
+
+#### Batch Jobs ####
+# --jobs runs a json lines file of {"function": ..., "args": {...}, "outFile": ...} specs as one plan. Per-input lookups are
+# split out and shared between jobs, tasks are grouped by function and run together against the api client, and each record is
+# streamed to the ndjson outFile of every job that asked for it (default <jobs file>.<line>.<function>.ndjson)
+
+SPLIT_ARGS = { # functions whose results are per input, so jobs asking for the same input can share one task
+  'getUserInfo': 'usernames',
+  'getHashtagInfo': 'hashtags',
+  'getTikTokByUrl': 'urls',
+  'byUsername': 'usernames',
+  'byHashtag': 'hashtags',
+}
+
+class JobTask: # one unit of the plan, ITER_MAP[function](**args), and the jobs its records go to
+  def __init__(self, function:str, args:dict):
+    self.function = function
+    self.args = args
+    self.jobs = []
+    self.errors = []
+
+def loadJobs(path:str, iterMap:dict) -> list: # raises ValueError/TypeError naming the first bad line
+  jobs = []
+  with open(path) as f:
+    for line, text in enumerate(f, 1):
+      if not text.strip():
+        continue
+      try:
+        spec = json.loads(text)
+      except ValueError as e:
+        raise ValueError("Line %d: invalid json: %s" % (line, e))
+      if not isinstance(spec, dict):
+        raise ValueError("Line %d: expected a json object, got %s" % (line, type(spec).__name__))
+      function = spec.get('function')
+      if function not in iterMap:
+        raise ValueError("Line %d: unknown function for --jobs: %s" % (line, function))
+      args = spec.get('args') or {}
+      if not isinstance(args, dict):
+        raise ValueError("Line %d: args must be a json object, got %s" % (line, type(args).__name__))
+      args = dict(args)
+      for name in SPLIT_ARGS.values():
+        if isinstance(args.get(name), str):
+          args[name] = [args[name]]
+      try:
+        inspect.signature(iterMap[function]).bind(**args)
+      except TypeError as e:
+        raise TypeError("Line %d: %s" % (line, e))
+      if not isinstance(spec.get('outFile') or '', str):
+        raise ValueError("Line %d: outFile must be a string, got %s" % (line, type(spec['outFile']).__name__))
+      outFile = spec.get('outFile') or '%s.%d.%s.ndjson' % (os.path.splitext(path)[0], line, function)
+      jobs.append({'line': line, 'function': function, 'args': args, 'outFile': outFile, 'records': 0, 'errors': []})
+  return jobs
+
+def planJobs(jobs:list) -> list: # the distinct tasks behind all jobs, grouped by function in first-seen order
+  tasks = {}
+  for job in jobs:
+    function, args = job['function'], job['args']
+    name = SPLIT_ARGS.get(function)
+    for taskArgs in ([dict(args, **{name: [item]}) for item in dict.fromkeys(args.get(name) or [])] if name else [args]):
+      key = json.dumps([function, taskArgs], sort_keys=True, default=str)
+      if key not in tasks:
+        tasks[key] = JobTask(function, taskArgs)
+      tasks[key].jobs.append(job)
+  return sorted(tasks.values(), key=lambda task: task.function)
+
+def runJobs(jobs:list, iterMap:dict) -> list: # runs loadJobs' jobs, returning them with the number of records and errors each got
+  tasks = planJobs(jobs)
+  counts = {}
+  for task in tasks:
+    counts[task.function] = counts.get(task.function, 0) + 1
+  print(len(jobs), "jobs planned as", len(tasks), "tasks:", ', '.join('%s x%d' % item for item in counts.items()))
+  def run(task):
+    params = inspect.signature(iterMap[task.function]).parameters
+    return iterMap[task.function](**(dict(task.args, errors=task.errors) if 'errors' in params else task.args))
+  failed = []
+  files = {job['outFile']: None for job in jobs}
+  try:
+    for outFile in files:
+      files[outFile] = open(outFile, 'w')
+    for task, record in fanOutStream(run, tasks, errors=failed):
+      if record is STREAM_DONE:
+        for job in task.jobs:
+          job['errors'].extend(task.errors)
+        continue
+      line = json.dumps(record, default=recordToJson) + '\n'
+      for job in task.jobs:
+        files[job['outFile']].write(line)
+        files[job['outFile']].flush()
+        job['records'] += 1
+  finally:
+    for outfile in files.values():
+      if outfile:
+        outfile.close()
+  for error in failed:
+    for job in error['input'].jobs:
+      job['errors'].append({'input': error['input'].args, 'error': error['error']})
+  for job in jobs:
+    print("Job on line %d (%s): %d records, %d errors -> %s" % (job['line'], job['function'], job['records'], len(job['errors']), job['outFile']))
+    if job['errors']:
+      with open(job['outFile'] + '.errors.json', 'w') as outfile:
+        json.dump(job['errors'], outfile, default=str)
+  return jobs
+
+CHECKPOINTED_FUNCTIONS = ['getTrendingTikToks', 'byUsername', 'byHashtag', 'getSuggestedUsers', 'getSuggestedHashtags', 'getUserInfo', 'getHashtagInfo', 'getTikTokByUrl']
+
 def main():
 # optional arguments:
 # -h, --help            show this help message and exit
@@ -262,10 +1035,26 @@ def main():
     'byUsername': byUsername,
     'byHashtag': byHashtag,
     'getTikTokByUrl': getTikTokByUrl,
+    'crawlSuggestedUsers': crawlSuggestedUsers,
     'viewTikTokByAddr': viewTikTokByAddr
   }
+  ITER_MAP = { # generator versions used by --format ndjson
+    'getTrendingTikToks': iterTrendingTikToks,
+    'getTrendingHashtags': iterTrendingHashtags,
+    'getTrendingMusic': iterTrendingMusic,
+    'getHashtagInfo': iterHashtagInfo,
+    'getUserInfo': iterUserInfo,
+    'getUserLikedByUsername': iterUserLikedByUsername,
+    'getSuggestedUsers': iterSuggestedUsers,
+    'getSuggestedHashtags': iterSuggestedHashtags,
+    'getSuggestedMusic': iterSuggestedMusic,
+    'byUsername': iterByUsername,
+    'byHashtag': iterByHashtag,
+    'getTikTokByUrl': iterTikTokByUrl,
+    'crawlSuggestedUsers': iterCrawlSuggestedUsers
+  }
   parser = argparse.ArgumentParser()
-  parser.add_argument("--function", choices = FUNCTION_MAP.keys(), required=True)
+  parser.add_argument("--function", choices = FUNCTION_MAP.keys(), required=False)
   parser.add_argument("--n", type=int, required=False)
   parser.add_argument("--printOutput", type=str, required=False)
   parser.add_argument("--hashtag", nargs='+', required=False)
@@ -273,64 +1062,235 @@ def main():
   parser.add_argument("--url", nargs='+', required=False)
   parser.add_argument("--download", default=False, action='store_true')
   parser.add_argument("--outFile", type=str, required=False)
+  parser.add_argument("--format", choices = ['json', 'ndjson', 'parquet'], default='json')
+  parser.add_argument("--resume", default=False, action='store_true')
+  parser.add_argument("--poolSize", type=int, required=False)
+  parser.add_argument("--downloadWorkers", type=int, required=False)
+  parser.add_argument("--userCacheTtl", type=float, required=False)
+  parser.add_argument("--cacheDir", type=str, required=False)
+  parser.add_argument("--noCache", default=False, action='store_true')
+  parser.add_argument("--cacheStats", default=False, action='store_true')
+  parser.add_argument("--unordered", default=False, action='store_true')
+  parser.add_argument("--rateLimit", type=float, required=False)
+  parser.add_argument("--maxRetries", type=int, required=False)
+  parser.add_argument("--warehouse", type=str, required=False)
+  parser.add_argument("--incremental", default=False, action='store_true')
+  parser.add_argument("--stateFile", type=str, default='tiktokCrawlState.json')
+  parser.add_argument("--depth", type=int, default=2)
+  parser.add_argument("--maxUsers", type=int, default=1000)
+  parser.add_argument("--metrics", default=False, action='store_true', help="Print latency percentiles and counters on exit")
+  parser.add_argument("--metricsFile", type=str, required=False, help="Write metrics to this file, Prometheus text if it ends in .prom, json otherwise")
+  parser.add_argument("--serve", default=False, action='store_true', help="Answer json requests for every function over http instead of running one")
+  parser.add_argument("--host", type=str, default='127.0.0.1')
+  parser.add_argument("--port", type=int, default=8765)
+  parser.add_argument("--socket", type=str, required=False, help="Serve on this unix socket instead of host:port")
+  parser.add_argument("--jobs", type=str, required=False, help="Json lines file of {function, args, outFile} specs to run together")
 
   default_n = 10
   default_print = False
 
   args = parser.parse_args()
+  if not args.function and not args.serve and not args.jobs:
+    parser.error("one of --function, --serve or --jobs is required")
+  if args.poolSize is not None and args.poolSize != MAX_CLIENTS:
+    parser.error("--poolSize must be %d, TikTokApi allows one client per process" % MAX_CLIENTS)
+  if args.rateLimit:
+    scheduler.rate = args.rateLimit
+  if args.maxRetries is not None:
+    scheduler.maxRetries = args.maxRetries
+  if args.unordered:
+    global fanOutOrdered
+    fanOutOrdered = False
+  if args.cacheDir:
+    responseCache.path = os.path.join(args.cacheDir, 'responses.sqlite')
+  if args.noCache:
+    api.enabled = False
+  if args.userCacheTtl is not None:
+    userCache.ttl = args.userCacheTtl
+  for endpoint in ('getUser', 'userPage'): # a profile or first page from disk must not be older than userCache would allow
+    ENDPOINT_TTLS[endpoint] = min(ENDPOINT_TTLS[endpoint], userCache.ttl)
+  if args.warehouse or args.incremental: # stats snapshots and new-video checks need what TikTok says now
+    for endpoint in LIVE_ENDPOINTS:
+      ENDPOINT_TTLS[endpoint] = 0
+  if args.downloadWorkers:
+    global downloader
+    downloader = TikTokDownloader(workers=args.downloadWorkers, perHostLimit=4)
+  FUNCTION_MAP = {name: metrics.timed('function_seconds')(function) for name, function in FUNCTION_MAP.items()}
+  ITER_MAP = {name: metrics.timedIter('function_seconds', name)(function) for name, function in ITER_MAP.items()} # labelled like the FUNCTION_MAP entry
+  try:
+    if args.serve:
+      serve(FUNCTION_MAP, args.host, args.port, args.socket)
+    elif args.jobs:
+      try:
+        jobs = loadJobs(args.jobs, ITER_MAP)
+      except (ValueError, TypeError) as e: # a bad line in the jobs file, reported before any job runs
+        print("Error in", args.jobs + ":", e)
+      else:
+        runJobs(jobs, ITER_MAP)
+    else:
+      runFunction(FUNCTION_MAP, ITER_MAP, args, default_n, default_print)
+  except ClientStartError as e: # nothing can be fetched, so report it once instead of as every input's error
+    print(e)
+  finally:
+    apiPool.shutdown()
+    downloader.close()
+    responseCache.close()
+    if args.metrics or args.metricsFile:
+      reportMetrics(args.metrics, args.metricsFile)
+  if args.cacheStats:
+    print("Response cache: ", responseCache.stats())
+    print("User cache: ", userCache.stats())
+    print("Coalesced in-flight lookups: ", inFlight.shared)
+
+def runFunction(FUNCTION_MAP, ITER_MAP, args, default_n, default_print):
   func = FUNCTION_MAP[args.function]
   out = None
-  if args.function == 'getTrendingTikToks':
-    out = func(args.n or default_n, args.printOutput or default_print, args.download)
-  if args.function == 'getTrendingHashtags' or args.function == 'getTrendingMusic':
-    out = func(args.n or default_n, args.printOutput or default_print)
+  errors = [] # per-input failures from the fanned-out functions
+  fnArgs = None
+  if args.function == 'getTrendingTikToks' or args.function == 'getTrendingHashtags' or args.function == 'getTrendingMusic':
+    fnArgs = [args.n or default_n]
   if args.function == 'getHashtagInfo':
     if not args.hashtag:
       print("No hashtag given")
       return
-    out = func(args.hashtag, args.printOutput or default_print)
+    fnArgs = [args.hashtag]
   if args.function == 'getUserInfo':
     if not args.username:
       print("No username given")
       return
-    out = func(args.username, args.printOutput or default_print)
-  if args.function == 'getUserLikedByUsername':
-    if not args.username:
-      print("No username given")
-      return
-    out = func(args.username, args.n or default_n, args.printOutput or default_print, args.download)
-  if args.function == 'getSuggestedUsers':
-    if not args.username:
-      print("No username given")
-      return
-    out = func(args.username, args.n or default_n, args.printOutput or default_print)
-  if args.function == 'getSuggestedHashtags':
+    fnArgs = [args.username]
+  if args.function == 'getUserLikedByUsername' or args.function == 'getSuggestedUsers' or args.function == 'getSuggestedHashtags' or args.function == 'getSuggestedMusic':
     if not args.username:
       print("No username given")
       return
-    out = func(args.username, args.n or default_n, args.printOutput or default_print)
+    fnArgs = [args.username, args.n or default_n]
   if args.function == 'byUsername':
     if not args.username:
       print('No username given')
       return
-    out = func(args.username, args.n or default_n, args.printOutput or default_print, args.download)
+    fnArgs = [args.username, args.n or default_n]
   if args.function == 'byHashtag':
     if not args.hashtag:
       print('No hashtag given')
       return
-    out = func(args.hashtag, args.n or default_n, args.printOutput or default_print, args.download)
-  if args.function == 'getTikTokByUrl':
-    if not args.url:
-      print('No url given')
+    fnArgs = [args.hashtag, args.n or default_n]
+  if args.function == 'crawlSuggestedUsers':
+    if not args.username:
+      print('No username given')
       return
-    out = func(args.url, args.printOutput or default_print, args.download)
-  if args.function == 'viewTikTokByAddr':
+    fnArgs = [args.username, args.n or default_n, args.depth, args.maxUsers]
+  if args.function == 'getTikTokByUrl' or args.function == 'viewTikTokByAddr':
     if not args.url:
       print('No url given')
       return
-    out = func(args.url)
+    fnArgs = [args.url]
+
+  if args.resume and (args.format != 'ndjson' or args.function not in CHECKPOINTED_FUNCTIONS):
+    print("--resume needs --format ndjson and one of: ", ', '.join(CHECKPOINTED_FUNCTIONS))
+    return
+  if args.format == 'ndjson' and args.function not in ITER_MAP:
+    print("--format ndjson only works with: ", ', '.join(ITER_MAP))
+    return
+  if (args.format == 'parquet' or args.warehouse) and args.function not in RECORD_TYPES:
+    print("--format parquet and --warehouse only work with: ", ', '.join(RECORD_TYPES))
+    return
+  if args.incremental and (args.resume or args.function not in ('byUsername', 'byHashtag')):
+    print("--incremental only works with byUsername or byHashtag, without --resume")
+    return
+
+  # printOutput, download and errors are passed to whichever functions take them
+  params = inspect.signature(func).parameters
+  kwargs = {name: value for name, value in (('printOutput', args.printOutput or default_print), ('download', args.download), ('errors', errors)) if name in params}
+  snapshot = None # appends each batch of results to the --warehouse stats history
+  if args.warehouse and args.function in RECORD_TYPES:
+    warehouse = StatsWarehouse(args.warehouse)
+    snapshot = lambda records: warehouse.snapshot(records, RECORD_TYPES[args.function])
+  if args.incremental: # only tiktoks newer than the last run's, watermarks are saved once the output is written
+    state = DeltaState(args.stateFile)
+    records = metrics.timedIter('function_seconds', args.function)(iterIncremental)('user' if args.function == 'byUsername' else 'hashtag', fnArgs[0], fnArgs[1], state, errors)
+    records = withSideEffects(records, kwargs.get('printOutput'), kwargs.get('download'), snapshot)
+    if args.format == 'parquet':
+      writeParquet(records, args.outFile, RECORD_TYPES[args.function], metrics=metrics)
+    elif args.format == 'ndjson':
+      writeNdjson(records, args.outFile)
+    else:
+      with open(args.outFile, 'w') as outfile:
+        json.dump(list(records), outfile)
+    state.save()
+  elif args.format == 'ndjson' and args.function in CHECKPOINTED_FUNCTIONS: # journal progress next to the output so --resume can pick up where a failed run stopped
+    journal = CrawlJournal(args.outFile + '.journal', args.resume)
+    try:
+      records = metrics.timedIter('function_seconds', args.function)(iterCheckpointed)(args.function, fnArgs, journal, errors)
+      writeNdjson(withSideEffects(records, kwargs.get('printOutput'), kwargs.get('download'), snapshot), args.outFile, append=args.resume)
+    finally:
+      journal.close()
+  elif args.format != 'json' and args.function in ITER_MAP:
+    iterKwargs = {'errors': errors} if 'errors' in params else {}
+    if args.format == 'parquet': # parquet rows are built from records, so skip the dicts
+      iterKwargs['records'] = True
+    records = withSideEffects(ITER_MAP[args.function](*fnArgs, **iterKwargs), kwargs.get('printOutput'), kwargs.get('download'), snapshot)
+    if args.format == 'parquet':
+      writeParquet(records, args.outFile, RECORD_TYPES[args.function], metrics=metrics)
+    else:
+      writeNdjson(records, args.outFile)
+  else:
+    out = func(*fnArgs, **kwargs)
+    with metrics.timer('write_seconds', 'json'), open(args.outFile, 'w') as outfile:
+      json.dump(out, outfile, default=recordToJson)
+    if snapshot:
+      snapshot(out)
+  if errors:
+    print(len(errors), "inputs failed, see", args.outFile + '.errors.json')
+    with open(args.outFile + '.errors.json', 'w') as outfile:
+      json.dump(errors, outfile)
+
+def writeNdjson(records, outFile:str, append:bool = False): # writes and flushes one json line per record as it arrives
+  with open(outFile, 'a' if append else 'w') as outfile:
+    for record in records:
+      with metrics.timer('write_seconds', 'ndjson'):
+        outfile.write(json.dumps(record, default=recordToJson) + '\n')
+        outfile.flush()
+
+def withSideEffects(records, printOutput:bool = False, download:bool = False, snapshot = None): # passes streamed records through, printing them, downloading their videos and snapshotting them in batches
+  dirName = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+  batch = []
+  snapshotBatch = []
+  for record in records:
+    yield record
+    if printOutput:
+      pp.pprint(record)
+    if download:
+      batch.append(record)
+      if len(batch) >= downloader.workers:
+        downloadTikToks(batch, dirName)
+        batch = []
+    if snapshot:
+      snapshotBatch.append(record)
+      if len(snapshotBatch) >= 500:
+        snapshot(snapshotBatch)
+        snapshotBatch = []
+  if batch:
+    downloadTikToks(batch, dirName)
+  if snapshotBatch:
+    snapshot(snapshotBatch)
 
-  with open(args.outFile, 'w') as outfile:
-    json.dump(out, outfile)
+def reportMetrics(printSummary:bool = False, path:str = None): # adds cache, retry and browser startup figures kept elsewhere, then prints and/or dumps everything
+  for name, cache in (('responses', responseCache), ('users', userCache)):
+    metrics.count('cache_hits', cache.hits, name)
+    metrics.count('cache_misses', cache.misses, name)
+  metrics.count('coalesced_requests', inFlight.shared)
+  for endpoint, retries in scheduler.stats()['retries'].items():
+    metrics.count('api_retries', retries, endpoint)
+  for seconds in apiPool.startupSeconds:
+    metrics.observe('browser_startup_seconds', seconds)
+  if printSummary:
+    summary = metrics.summary()
+    for name, histogram in summary['histograms'].items():
+      print("%-40s n=%-7d p50=%.4fs p95=%.4fs p99=%.4fs max=%.4fs" % (name, histogram['count'], histogram['p50'], histogram['p95'], histogram['p99'], histogram['max']))
+    for name, value in summary['counters'].items():
+      print("%-40s %s" % (name, value))
+  if path:
+    metrics.dump(path)
 
-main()
+if __name__ == '__main__':
+  main()
@@ -1,13 +1,13 @@
 import pprint
 import argparse
-from TikTokApi import TikTokApi
+from tiktokApiPool import TikTokApiPool, PooledApi
 import inspect
 import json
 from datetime import datetime
 import requests
 import os
 
-api = TikTokApi(debug=True, executablePath="/usr/lib/chromium-browser/chromium-browser")
+api = PooledApi(TikTokApiPool(size=1, debug=True, executablePath="/usr/lib/chromium-browser/chromium-browser")) # browser is started on first use, not at import
 pp = pprint.PrettyPrinter()
 
 #### Aggregate Functions ####
@@ -323,4 +323,5 @@ def main():
   with open(args.outFile, 'w') as outfile:
     json.dump(out, outfile)
 
-main()
+if __name__ == '__main__':
+  main()
@@ -4,8 +4,8 @@
 # pip install TikTokApi
 
 import pprint
-from TikTokApi import TikTokApi
-api = TikTokApi(debug=True)
+from tiktokApiPool import TikTokApiPool, PooledApi
+api = PooledApi(TikTokApiPool(size=1, debug=True)) # browser is started on first use, not at import
 pp = pprint.PrettyPrinter()
 
 #### Aggregate Functions ####
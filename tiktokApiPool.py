@@ -0,0 +1,130 @@
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from TikTokApi import TikTokApi
+
+MAX_CLIENTS = 1 # TikTokApi 3.7+ raises "Only one TikTokApi object is allowed" on a second instance in the same process
+
+#### Client Owner ####
+
+class ClientStartError(RuntimeError): # the TikTokApi constructor failed, so no call can run until that is fixed
+  pass
+
+class TikTokApiPool: # owns the process's one TikTokApi instance (one headless chromium) on a dedicated thread and runs every call there
+  # TikTokApi's playwright sync browser only works from the thread that started it, so calls from any other thread are
+  # queued to the owner thread and run one at a time in arrival order. More parallelism than that needs worker processes
+  def __init__(self, size:int = MAX_CLIENTS, **apiKwargs):
+    if size != MAX_CLIENTS:
+      raise ValueError("TikTokApiPool size must be %d, TikTokApi allows one instance per process" % MAX_CLIENTS)
+    self.size = size
+    self.apiKwargs = apiKwargs
+    self.startupSeconds = []
+    self.calls = 0
+    self._client = None
+    self._thread = None
+    self._closed = False
+    self._queue = queue.Queue()
+    self._lock = threading.Lock()
+    atexit.register(self.shutdown)
+
+  def call(self, name:str, *args, **kwargs): # runs client.name(*args, **kwargs) on the owner thread and returns its result or raises its error
+    return self._submit(name, args, kwargs).result()
+
+  def warm(self): # starts the client ahead of time so the first real call doesn't pay for browser startup
+    self._submit(None, (), {}).result()
+
+  def shutdown(self) -> dict: # closes the client once the calls already queued have run
+    with self._lock:
+      self._closed = True
+      thread = self._thread
+      if thread is not None:
+        self._queue.put(None)
+    if thread is not None and thread is not threading.current_thread():
+      thread.join()
+    return self.stats()
+
+  def stats(self) -> dict:
+    return {
+      'size': self.size,
+      'started': len(self.startupSeconds),
+      'calls': self.calls,
+      'queued': self._queue.qsize(),
+      'startupSeconds': list(self.startupSeconds),
+    }
+
+  def _submit(self, name:str, args:tuple, kwargs:dict) -> Future:
+    future = Future()
+    with self._lock:
+      if self._closed:
+        raise RuntimeError("TikTokApiPool has been shut down")
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._run, name='TikTokApi', daemon=True)
+        self._thread.start()
+      self._queue.put((future, name, args, kwargs))
+    return future
+
+  def _run(self): # the owner thread; the client is only ever created, used and closed here
+    while True:
+      entry = self._queue.get()
+      if entry is None:
+        break
+      future, name, args, kwargs = entry
+      try:
+        if self._client is None:
+          self._client = self._startClient()
+        result = None
+        if name:
+          self.calls += 1
+          result = getattr(self._client, name)(*args, **kwargs)
+      except ClientStartError as e: # calls queued behind a failed start fail with it; later ones try to start the client again
+        future.set_exception(e)
+        self._failQueued(e)
+      except Exception as e:
+        future.set_exception(e)
+      else:
+        future.set_result(result)
+    if self._client is not None:
+      closeClient(self._client)
+      self._client = None
+
+  def _failQueued(self, error:Exception):
+    while True:
+      try:
+        entry = self._queue.get_nowait()
+      except queue.Empty:
+        return
+      if entry is None: # shutdown, leave it for _run
+        self._queue.put(None)
+        return
+      entry[0].set_exception(error)
+
+  def _startClient(self) -> TikTokApi:
+    start = time.perf_counter()
+    try:
+      client = TikTokApi(**self.apiKwargs)
+    except Exception as e:
+      raise ClientStartError("Could not start TikTokApi: %s" % e) from e
+    self.startupSeconds.append(time.perf_counter() - start)
+    return client
+
+class PooledApi: # drop-in stand-in for a TikTokApi instance; each method call is run by the pool's owner thread
+  def __init__(self, pool:TikTokApiPool):
+    self.pool = pool
+
+  def __getattr__(self, name:str):
+    def call(*args, **kwargs):
+      return self.pool.call(name, *args, **kwargs)
+    call.__name__ = name
+    return call
+
+def closeClient(client:TikTokApi):
+  for name in ('clean_up', 'close', 'quit'): # method name differs between TikTokApi versions
+    close = getattr(client, name, None)
+    if callable(close):
+      try:
+        close()
+      except Exception as e:
+        print("Error closing TikTokApi client: ", e)
+      return
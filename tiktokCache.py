@@ -0,0 +1,174 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+#### In-Memory Cache ####
+
+class TTLCache: # LRU cache whose entries also expire `ttl` seconds after being stored
+  def __init__(self, maxsize:int = 1024, ttl:float = 600):
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+    self._data = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key, default = None):
+    with self._lock:
+      entry = self._data.get(key)
+      if entry is None or entry[0] < time.monotonic():
+        if entry is not None:
+          del self._data[key]
+        self.misses += 1
+        return default
+      self._data.move_to_end(key)
+      self.hits += 1
+      return entry[1]
+
+  def peek(self, key, default = None): # like get, but leaves the hit/miss counts and LRU order alone
+    with self._lock:
+      entry = self._data.get(key)
+      return default if entry is None or entry[0] < time.monotonic() else entry[1]
+
+  def set(self, key, value):
+    with self._lock:
+      self._data[key] = (time.monotonic() + self.ttl, value)
+      self._data.move_to_end(key)
+      while len(self._data) > self.maxsize:
+        self._data.popitem(last=False)
+
+  def clear(self):
+    with self._lock:
+      self._data.clear()
+
+  def stats(self) -> dict:
+    total = self.hits + self.misses
+    return {
+      'size': len(self._data),
+      'hits': self.hits,
+      'misses': self.misses,
+      'hitRate': self.hits / total if total else 0.0,
+    }
+
+#### Persistent Cache ####
+
+class ResponseCache: # sqlite file of raw api responses keyed by endpoint name plus arguments; opened on first use
+  def __init__(self, path:str = 'tiktokCache/responses.sqlite'):
+    self.path = path
+    self.hits = 0
+    self.misses = 0
+    self.bytesSaved = 0
+    self._conn = None
+    self._lock = threading.Lock()
+
+  def get(self, key:str) -> tuple: # returns (found, value)
+    with self._lock:
+      row = self._db().execute('SELECT value, expires FROM responses WHERE key = ?', (key,)).fetchone()
+      if row is None or row[1] < time.time():
+        self.misses += 1
+        return False, None
+      self.hits += 1
+      self.bytesSaved += len(row[0])
+      return True, json.loads(row[0])
+
+  def set(self, key:str, endpoint:str, value, ttl:float):
+    try:
+      text = json.dumps(value)
+    except TypeError: # not plain json, leave it uncached
+      return
+    with self._lock:
+      db = self._db()
+      db.execute('INSERT OR REPLACE INTO responses (key, endpoint, value, expires) VALUES (?, ?, ?, ?)', (key, endpoint, text, time.time() + ttl))
+      db.commit()
+
+  def purgeExpired(self): # also run whenever the cache is opened, so a cache used from cron doesn't grow without bound
+    with self._lock:
+      deleteExpired(self._db())
+
+  def stats(self) -> dict:
+    total = self.hits + self.misses
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'hitRate': self.hits / total if total else 0.0,
+      'bytesSaved': self.bytesSaved,
+    }
+
+  def close(self):
+    with self._lock:
+      if self._conn is not None:
+        self._conn.close()
+        self._conn = None
+
+  def _db(self) -> sqlite3.Connection:
+    if self._conn is None:
+      os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+      self._conn = sqlite3.connect(self.path, check_same_thread=False)
+      self._conn.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, endpoint TEXT, value TEXT, expires REAL)')
+      deleteExpired(self._conn)
+    return self._conn
+
+def deleteExpired(db:sqlite3.Connection):
+  db.execute('DELETE FROM responses WHERE expires < ?', (time.time(),))
+  db.commit()
+
+#### Request Coalescing ####
+
+class SingleFlight: # concurrent calls for the same key share one run of fn: the first caller runs it, the rest wait for its result or exception
+  def __init__(self):
+    self.shared = 0 # calls answered by another caller's run
+    self._calls = {}
+    self._lock = threading.Lock()
+
+  def do(self, key, fn, *args):
+    with self._lock:
+      future = self._calls.get(key)
+      if future is not None:
+        self.shared += 1
+        leader = False
+      else:
+        future = self._calls[key] = Future()
+        leader = True
+    if not leader:
+      return future.result()
+    try:
+      future.set_result(fn(*args))
+    except Exception as e:
+      future.set_exception(e)
+    finally:
+      with self._lock:
+        del self._calls[key]
+    return future.result()
+
+class CachedApi: # wraps a TikTokApi-like object so the endpoints listed in `ttls` are served from a ResponseCache
+  def __init__(self, api, cache:ResponseCache, ttls:dict):
+    self.api = api
+    self.cache = cache
+    self.ttls = ttls
+    self.enabled = True
+
+  def __getattr__(self, name:str):
+    method = getattr(self.api, name)
+    ttl = self.ttls.get(name)
+    if not ttl:
+      return method
+    def call(*args, **kwargs):
+      if not self.enabled:
+        return method(*args, **kwargs)
+      key = cacheKey(name, args, kwargs)
+      found, value = self.cache.get(key)
+      if found:
+        return value
+      value = method(*args, **kwargs)
+      if not (isinstance(value, dict) and value.get('statusCode', 0) != 0): # don't cache failed lookups
+        self.cache.set(key, name, value, ttl)
+      return value
+    call.__name__ = name
+    return call
+
+def cacheKey(name:str, args:tuple, kwargs:dict) -> str:
+  return json.dumps([name, list(args), kwargs], sort_keys=True, default=str)
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_HEADERS = {'referer': 'https://www.tiktok.com/'}
+CHUNK_SIZE = 64 * 1024
+
+#### Download Engine ####
+
+class TikTokDownloader: # downloads many files at once over one keep-alive session, with a cap on total and per-host concurrency
+  def __init__(self, workers:int = 8, perHostLimit:int = 4, headers:dict = None, timeout:float = 30, chunkSize:int = CHUNK_SIZE):
+    self.workers = workers
+    self.chunkSize = chunkSize
+    self.perHostLimit = perHostLimit
+    self.timeout = timeout
+    self.session = requests.Session()
+    self.session.headers.update(headers or DEFAULT_HEADERS)
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    self.session.mount('http://', adapter)
+    self.session.mount('https://', adapter)
+    self._hostLimits = {}
+    self._lock = threading.Lock()
+
+  def downloadAll(self, jobs:list) -> list: # jobs are (url, path) pairs; returns one result dict per job, in job order
+    if not jobs:
+      return []
+    with ThreadPoolExecutor(max_workers=min(self.workers, len(jobs))) as executor:
+      return list(executor.map(lambda job: self.download(*job), jobs))
+
+  def download(self, url:str, path:str) -> dict: # streams into path + '.part' and renames it into place once complete
+    # a .part file left by an earlier failed run is resumed with a Range request; 'bytes' counts only what was fetched now
+    start = time.perf_counter()
+    resp = {'url': url, 'path': path, 'bytes': 0, 'size': 0, 'sha256': None, 'error': None, 'seconds': 0.0}
+    tmpPath = path + '.part'
+    try:
+      with self._hostLimit(url):
+        offset = os.path.getsize(tmpPath) if os.path.exists(tmpPath) else 0
+        headers = {'Range': 'bytes=%d-' % offset} if offset else None
+        with self.session.get(url, timeout=self.timeout, stream=True, headers=headers) as r:
+          if offset and r.status_code == 416: # nothing past offset, the .part file already holds the whole video
+            chunks = []
+          else:
+            r.raise_for_status()
+            if r.status_code != 206: # server ignored the Range header, start over
+              offset = 0
+            chunks = r.iter_content(chunk_size=self.chunkSize)
+          digest = hashlib.sha256()
+          if offset:
+            hashFile(tmpPath, digest)
+          os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+          with open(tmpPath, 'ab' if offset else 'wb') as f:
+            for chunk in chunks:
+              f.write(chunk)
+              digest.update(chunk)
+              resp['bytes'] += len(chunk)
+      os.replace(tmpPath, path)
+      resp['size'] = offset + resp['bytes']
+      resp['sha256'] = digest.hexdigest()
+    except Exception as e:
+      print("Error downloading: ", url, e)
+      resp['error'] = str(e)
+    resp['seconds'] = time.perf_counter() - start
+    return resp
+
+  def close(self):
+    self.session.close()
+
+  def _hostLimit(self, url:str) -> threading.Semaphore:
+    host = urlparse(url).netloc
+    with self._lock:
+      if host not in self._hostLimits:
+        self._hostLimits[host] = threading.BoundedSemaphore(self.perHostLimit)
+      return self._hostLimits[host]
+
+#### Video Store ####
+
+class VideoStore: # downloaded videos keyed by tiktok id, with a manifest.json of size, checksum and source url per id
+  def __init__(self, root:str = 'downloadedTikToks/store'):
+    self.root = root
+    self.manifestPath = os.path.join(root, 'manifest.json')
+    self._lock = threading.Lock()
+    self.manifest = {}
+    if os.path.exists(self.manifestPath):
+      with open(self.manifestPath) as f:
+        self.manifest = json.load(f)
+
+  def pathFor(self, id) -> str:
+    return os.path.join(self.root, str(id) + '.mp4')
+
+  def has(self, id) -> bool: # true if the video is in the manifest and its file is on disk with the recorded size
+    entry = self.manifest.get(str(id))
+    path = self.pathFor(id)
+    return bool(entry) and os.path.exists(path) and os.path.getsize(path) == entry['size']
+
+  def add(self, id, result:dict):
+    with self._lock:
+      self.manifest[str(id)] = {'size': result['size'], 'sha256': result['sha256'], 'url': result['url']}
+
+  def save(self):
+    with self._lock:
+      os.makedirs(self.root, exist_ok=True)
+      with open(self.manifestPath + '.part', 'w') as f:
+        json.dump(self.manifest, f)
+      os.replace(self.manifestPath + '.part', self.manifestPath)
+
+  def link(self, id, path:str): # exposes a stored video at path, as a hardlink where the filesystem allows it
+    if os.path.exists(path):
+      return
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    try:
+      os.link(self.pathFor(id), path)
+    except OSError:
+      shutil.copyfile(self.pathFor(id), path)
+
+def hashFile(path:str, digest):
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+      digest.update(chunk)
+  return digest
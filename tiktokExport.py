@@ -0,0 +1,70 @@
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from tiktokRecords import Record
+try:
+  import pyarrow as pa
+  import pyarrow.parquet as pq
+except ImportError: # only needed for --format parquet
+  pa = pq = None
+
+ROW_GROUP_SIZE = 10000
+
+#### Parquet Export ####
+
+def schemaFor(recordType) -> 'pa.Schema': # fixed schema per record type: counters are int64, createTime a UTC timestamp, the rest strings/bools
+  types = {
+    'createTime': pa.timestamp('s', tz='UTC'),
+    'verified': pa.bool_(),
+    'id': pa.string(),
+    'desc': pa.string(),
+    'title': pa.string(),
+    'username': pa.string(),
+    'playAddr': pa.string(),
+    'playUrl': pa.string(),
+  }
+  return pa.schema([(name, types.get(name, pa.int64())) for name in recordType.__slots__])
+
+class ParquetRecordWriter: # streams records of one type into a parquet file, buffering at most one row group in memory
+  def __init__(self, path:str, recordType, rowGroupSize:int = ROW_GROUP_SIZE, compression:str = 'zstd'):
+    if pa is None:
+      raise ImportError("Parquet output needs pyarrow (pip install pyarrow)")
+    self.recordType = recordType
+    self.rowGroupSize = rowGroupSize
+    self.schema = schemaFor(recordType)
+    self.rows = 0
+    self._columns = {name: [] for name in self.schema.names}
+    self._writer = pq.ParquetWriter(path, self.schema, compression=compression)
+
+  def write(self, record): # takes a record object or one of the wrapper dicts
+    if not isinstance(record, Record):
+      record = self.recordType.fromDict(record)
+    for name, column in self._columns.items():
+      value = getattr(record, name)
+      if name == 'createTime' and isinstance(value, str): # processTikTokObject's local time, back to the instant it names
+        value = datetime.fromisoformat(value).astimezone(timezone.utc)
+      column.append(value)
+    self.rows += 1
+    if len(self._columns['id']) >= self.rowGroupSize:
+      self.flush()
+
+  def flush(self):
+    if self._columns['id']:
+      self._writer.write_table(pa.Table.from_pydict(self._columns, schema=self.schema))
+      self._columns = {name: [] for name in self.schema.names}
+
+  def close(self):
+    self.flush()
+    self._writer.close()
+
+def writeParquet(records, path:str, recordType, rowGroupSize:int = ROW_GROUP_SIZE, metrics = None) -> int: # returns the number of rows written
+  # with a tiktokMetrics.Metrics, every write (and the final flush) is timed as write_seconds{parquet}
+  timer = (lambda: metrics.timer('write_seconds', 'parquet')) if metrics is not None else nullcontext
+  writer = ParquetRecordWriter(path, recordType, rowGroupSize)
+  try:
+    for record in records:
+      with timer():
+        writer.write(record)
+  finally:
+    with timer():
+      writer.close()
+  return writer.rows
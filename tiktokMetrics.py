@@ -0,0 +1,175 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+BUCKETS = tuple(0.0001 * 2 ** i for i in range(21)) # upper bounds in seconds, doubling from 0.1ms to ~105s
+
+#### Histograms ####
+
+class Histogram: # observation counts per bucket; quantiles are interpolated inside the bucket they land in
+  def __init__(self, buckets:tuple = BUCKETS):
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1) # last slot is everything above the largest bound
+    self.count = 0
+    self.sum = 0.0
+    self.max = 0.0
+
+  def observe(self, value:float):
+    self.counts[bisect.bisect_left(self.buckets, value)] += 1
+    self.count += 1
+    self.sum += value
+    self.max = max(self.max, value)
+
+  def quantile(self, q:float) -> float:
+    if not self.count:
+      return None
+    rank = q * self.count
+    seen = 0
+    for i, count in enumerate(self.counts):
+      if count and seen + count >= rank:
+        lower = self.buckets[i - 1] if i else 0.0
+        upper = self.buckets[i] if i < len(self.buckets) else self.max
+        return min(self.max, lower + (upper - lower) * (rank - seen) / count)
+      seen += count
+    return self.max
+
+  def summary(self) -> dict:
+    return {
+      'count': self.count,
+      'sum': self.sum,
+      'mean': self.sum / self.count if self.count else None,
+      'p50': self.quantile(0.5),
+      'p95': self.quantile(0.95),
+      'p99': self.quantile(0.99),
+      'max': self.max,
+    }
+
+#### Metrics Registry ####
+
+class Metrics: # named histograms and counters, each optionally split by one label (endpoint, function, format...)
+  def __init__(self, prefix:str = 'tiktok'):
+    self.prefix = prefix
+    self.histograms = {} # (name, label) -> Histogram
+    self.counters = {} # (name, label) -> number
+    self._lock = threading.Lock()
+
+  def observe(self, name:str, value:float, label:str = None):
+    with self._lock:
+      key = (name, label)
+      if key not in self.histograms:
+        self.histograms[key] = Histogram()
+      self.histograms[key].observe(value)
+
+  def count(self, name:str, value:float = 1, label:str = None):
+    with self._lock:
+      self.counters[(name, label)] = self.counters.get((name, label), 0) + value
+
+  @contextmanager
+  def timer(self, name:str, label:str = None):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.observe(name, time.perf_counter() - start, label)
+
+  def timed(self, name:str, label:str = None): # decorator timing every call of a function, labelled with its name by default
+    def decorate(fn):
+      @wraps(fn)
+      def call(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+          return fn(*args, **kwargs)
+        except Exception:
+          self.count(name.replace('_seconds', '_errors'), 1, label or fn.__name__)
+          raise
+        finally:
+          self.observe(name, time.perf_counter() - start, label or fn.__name__)
+      return call
+    return decorate
+
+  def timedIter(self, name:str, label:str = None): # timed for generator functions: from the call until the generator is exhausted or closed, so consuming it is included
+    def decorate(fn):
+      @wraps(fn)
+      def call(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+          yield from fn(*args, **kwargs)
+        except Exception:
+          self.count(name.replace('_seconds', '_errors'), 1, label or fn.__name__)
+          raise
+        finally:
+          self.observe(name, time.perf_counter() - start, label or fn.__name__)
+      return call
+    return decorate
+
+  def summary(self) -> dict:
+    with self._lock:
+      return {
+        'histograms': {metricName(name, label): histogram.summary() for (name, label), histogram in sorted(self.histograms.items(), key=sortKey)},
+        'counters': {metricName(name, label): value for (name, label), value in sorted(self.counters.items(), key=sortKey)},
+      }
+
+  def toPrometheus(self) -> str: # text exposition format, with cumulative le buckets per histogram
+    lines = []
+    typed = set()
+    def declare(name, kind):
+      if name not in typed:
+        typed.add(name)
+        lines.append('# TYPE %s_%s %s' % (self.prefix, name, kind))
+    with self._lock:
+      for (name, label), value in sorted(self.counters.items(), key=sortKey):
+        declare(name, 'counter')
+        lines.append('%s_%s%s %s' % (self.prefix, name, labelText(label), value))
+      for (name, label), histogram in sorted(self.histograms.items(), key=sortKey):
+        declare(name, 'histogram')
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+          cumulative += count
+          lines.append('%s_%s_bucket%s %d' % (self.prefix, name, labelText(label, '+Inf' if bound == float('inf') else repr(bound)), cumulative))
+        lines.append('%s_%s_sum%s %r' % (self.prefix, name, labelText(label), histogram.sum))
+        lines.append('%s_%s_count%s %d' % (self.prefix, name, labelText(label), histogram.count))
+    return '\n'.join(lines) + '\n'
+
+  def dump(self, path:str): # Prometheus text for a .prom file, json otherwise
+    with open(path, 'w') as f:
+      if path.endswith('.prom'):
+        f.write(self.toPrometheus())
+      else:
+        json.dump(self.summary(), f, indent=2)
+
+class InstrumentedApi: # wraps a TikTokApi-like object, timing every method call and counting requests and failed responses per endpoint
+  def __init__(self, api, metrics:Metrics):
+    self.api = api
+    self.metrics = metrics
+
+  def __getattr__(self, name:str):
+    method = getattr(self.api, name)
+    def call(*args, **kwargs):
+      start = time.perf_counter()
+      self.metrics.count('api_requests', 1, name)
+      try:
+        result = method(*args, **kwargs)
+      except Exception:
+        self.metrics.count('api_errors', 1, name)
+        raise
+      finally:
+        self.metrics.observe('api_call_seconds', time.perf_counter() - start, name)
+      if isinstance(result, dict) and result.get('statusCode', 0) != 0:
+        self.metrics.count('api_errors', 1, name)
+      return result
+    call.__name__ = name
+    return call
+
+def metricName(name:str, label:str = None) -> str:
+  return name if label is None else '%s{%s}' % (name, label)
+
+def labelText(label:str = None, le:str = None) -> str:
+  pairs = ([('name', label)] if label is not None else []) + ([('le', le)] if le is not None else [])
+  return '{' + ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in pairs) + '}' if pairs else ''
+
+def sortKey(item) -> tuple:
+  (name, label), value = item
+  return (name, label or '')
@@ -0,0 +1,53 @@
+#### Record Types ####
+# compact alternatives to the per-record dicts built by mergedTikTokApi; fields match the dict keys
+
+class Record:
+  __slots__ = ()
+  ALIASES = {} # field -> older dict key to fall back on in fromDict
+
+  def __init__(self, *args, **kwargs):
+    for name, value in zip(self.__slots__, args):
+      setattr(self, name, value)
+    for name in self.__slots__[len(args):]:
+      setattr(self, name, kwargs.get(name))
+
+  @classmethod
+  def fromDict(cls, d:dict):
+    return cls(*[d.get(name, d.get(cls.ALIASES.get(name))) for name in cls.__slots__])
+
+  def toDict(self) -> dict:
+    return {name: getattr(self, name) for name in self.__slots__}
+
+  def __getitem__(self, name:str): # lets code written for the dicts (e.g. tiktok['playAddr']) take records too
+    try:
+      return getattr(self, name)
+    except AttributeError:
+      raise KeyError(name)
+
+  def get(self, name:str, default = None):
+    return getattr(self, name, default)
+
+  def __eq__(self, other) -> bool:
+    return type(self) is type(other) and all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+  def __repr__(self) -> str:
+    return type(self).__name__ + '(' + ', '.join(name + '=' + repr(getattr(self, name)) for name in self.__slots__) + ')'
+
+class Video(Record):
+  __slots__ = ('id', 'desc', 'createTime', 'playAddr', 'username', 'diggCount', 'shareCount', 'commentCount', 'playCount')
+  ALIASES = {'desc': 'text'} # byHashtag's legacy records
+
+class User(Record):
+  __slots__ = ('id', 'username', 'verified', 'followingCount', 'followerCount', 'heartCount', 'videoCount', 'diggCount')
+
+class Hashtag(Record):
+  __slots__ = ('id', 'title', 'desc', 'videoCount', 'viewCount')
+  ALIASES = {'viewCount': 'views'} # getTrendingHashtags
+
+class Music(Record):
+  __slots__ = ('id', 'title', 'desc', 'playUrl', 'videoCount')
+
+def recordToJson(obj): # json.dump(..., default=recordToJson) writes records as plain objects
+  if isinstance(obj, Record):
+    return obj.toDict()
+  raise TypeError("Object of type " + type(obj).__name__ + " is not JSON serializable")
@@ -0,0 +1,124 @@
+import random
+import threading
+import time
+
+PERMANENT_STATUS_CODES = {10202} # user does not exist, retrying won't help
+
+#### Rate Limiting ####
+
+class TokenBucket: # allows `rate` calls per second on average, with bursts of up to `burst`
+  def __init__(self, rate:float, burst:int):
+    self.rate = rate
+    self.burst = burst
+    self._tokens = burst
+    self._last = time.monotonic()
+    self._lock = threading.Lock()
+
+  def acquire(self):
+    while True:
+      with self._lock:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        if self._tokens >= 1:
+          self._tokens -= 1
+          return
+        wait = (1 - self._tokens) / self.rate
+      time.sleep(wait)
+
+class RequestScheduler: # per-endpoint token buckets, retries with exponential backoff and jitter, and an AIMD limit on concurrent calls
+  # a call fails if it raises or returns a non-zero statusCode. Each failure halves the concurrency limit and
+  # each success raises it by 1/limit, so the limit settles just under what TikTok tolerates. fatalErrors are raised
+  # straight away, without a retry or a failure, for errors that say nothing about the endpoint (e.g. the client not starting)
+  def __init__(self, rate:float = 2.0, burst:int = 4, rates:dict = None, maxRetries:int = 3, baseDelay:float = 1.0, maxDelay:float = 30.0, maxConcurrency:int = 8, minConcurrency:int = 1, fatalErrors:tuple = ()):
+    self.rate = rate
+    self.burst = burst
+    self.rates = rates or {} # endpoint -> calls per second, overriding rate
+    self.maxRetries = maxRetries
+    self.baseDelay = baseDelay
+    self.maxDelay = maxDelay
+    self.maxConcurrency = maxConcurrency
+    self.minConcurrency = minConcurrency
+    self.fatalErrors = fatalErrors
+    self.limit = float(maxConcurrency)
+    self.calls = {}
+    self.failures = {}
+    self.retries = {}
+    self._buckets = {}
+    self._active = 0
+    self._cond = threading.Condition()
+
+  def call(self, endpoint:str, fn, *args, **kwargs):
+    attempt = 0
+    while True:
+      self._bucket(endpoint).acquire()
+      error = None
+      result = None
+      self._enter()
+      try:
+        result = fn(*args, **kwargs)
+      except Exception as e:
+        error = e
+      finally:
+        self._exit()
+      if isinstance(error, self.fatalErrors):
+        raise error
+      # a permanent status is a real answer rather than rate pressure, so it neither retries nor lowers the limit
+      failed = error is not None or (isinstance(result, dict) and result.get('statusCode', 0) != 0 and result['statusCode'] not in PERMANENT_STATUS_CODES)
+      self._record(endpoint, failed)
+      if not failed or attempt >= self.maxRetries:
+        if error is not None:
+          raise error
+        return result
+      attempt += 1
+      with self._cond:
+        self.retries[endpoint] = self.retries.get(endpoint, 0) + 1
+      time.sleep(random.uniform(0, min(self.maxDelay, self.baseDelay * 2 ** attempt))) # full jitter
+
+  def stats(self) -> dict:
+    with self._cond:
+      return {
+        'concurrencyLimit': round(self.limit, 2),
+        'calls': dict(self.calls),
+        'failures': dict(self.failures),
+        'retries': dict(self.retries),
+      }
+
+  def _bucket(self, endpoint:str) -> TokenBucket:
+    with self._cond:
+      if endpoint not in self._buckets:
+        self._buckets[endpoint] = TokenBucket(self.rates.get(endpoint, self.rate), self.burst)
+      return self._buckets[endpoint]
+
+  def _enter(self):
+    with self._cond:
+      while self._active >= max(self.minConcurrency, int(self.limit)):
+        self._cond.wait()
+      self._active += 1
+
+  def _exit(self):
+    with self._cond:
+      self._active -= 1
+      self._cond.notify_all()
+
+  def _record(self, endpoint:str, failed:bool):
+    with self._cond:
+      self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+      if failed:
+        self.failures[endpoint] = self.failures.get(endpoint, 0) + 1
+        self.limit = max(self.minConcurrency, self.limit / 2)
+      else:
+        self.limit = min(self.maxConcurrency, self.limit + 1 / self.limit)
+      self._cond.notify_all()
+
+class ScheduledApi: # wraps a TikTokApi-like object so every method call goes through a RequestScheduler
+  def __init__(self, api, scheduler:RequestScheduler):
+    self.api = api
+    self.scheduler = scheduler
+
+  def __getattr__(self, name:str):
+    method = getattr(self.api, name)
+    def call(*args, **kwargs):
+      return self.scheduler.call(name, method, *args, **kwargs)
+    call.__name__ = name
+    return call
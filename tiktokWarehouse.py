@@ -0,0 +1,73 @@
+import os
+import sqlite3
+import threading
+import time
+from tiktokRecords import Record
+
+# kind -> (descriptive fields upserted into <kind>, counters appended to <kind>_stats on every snapshot)
+WAREHOUSE_TABLES = {
+  'video': (['username', 'desc', 'createTime', 'playAddr'], ['diggCount', 'shareCount', 'commentCount', 'playCount']),
+  'user': (['username', 'verified'], ['followingCount', 'followerCount', 'heartCount', 'videoCount', 'diggCount']),
+  'hashtag': (['title', 'desc'], ['videoCount', 'viewCount']),
+  'music': (['title', 'desc', 'playUrl'], ['videoCount']),
+}
+
+#### Stats Warehouse ####
+
+class StatsWarehouse: # sqlite history of follower/view/play counts; one row per entity, one stats row per (entity, observedAt)
+  def __init__(self, path:str = 'tiktokWarehouse.sqlite'):
+    self.path = path
+    self._lock = threading.Lock()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    self._conn = sqlite3.connect(path, check_same_thread=False)
+    for kind, (fields, stats) in WAREHOUSE_TABLES.items():
+      self._conn.execute('CREATE TABLE IF NOT EXISTS %s (id TEXT PRIMARY KEY, %s, firstSeen INTEGER, lastSeen INTEGER)' % (kind, ', '.join('"%s"' % field for field in fields)))
+      self._conn.execute('CREATE TABLE IF NOT EXISTS %s_stats (id TEXT, observedAt INTEGER, %s, PRIMARY KEY (id, observedAt)) WITHOUT ROWID' % (kind, ', '.join('"%s" INTEGER' % stat for stat in stats)))
+    self._conn.commit()
+
+  def snapshot(self, records, recordType, observedAt:int = None) -> int: # upserts each record's entity and appends its counters; returns rows written
+    kind = recordType.__name__.lower()
+    fields, stats = WAREHOUSE_TABLES[kind]
+    observedAt = int(observedAt or time.time())
+    entities = []
+    snapshots = []
+    for record in records:
+      if not isinstance(record, Record):
+        record = recordType.fromDict(record)
+      if record.id is None:
+        continue
+      entities.append([str(record.id)] + [getattr(record, field) for field in fields] + [observedAt, observedAt])
+      snapshots.append([str(record.id), observedAt] + [getattr(record, stat) for stat in stats])
+    columns = ', '.join('"%s"' % field for field in fields)
+    updates = ', '.join('"%s" = excluded."%s"' % (field, field) for field in fields)
+    with self._lock:
+      self._conn.executemany('INSERT INTO %s (id, %s, firstSeen, lastSeen) VALUES (%s) ON CONFLICT(id) DO UPDATE SET %s, lastSeen = excluded.lastSeen'
+        % (kind, columns, ', '.join('?' * (len(fields) + 3)), updates), entities)
+      self._conn.executemany('INSERT OR REPLACE INTO %s_stats VALUES (%s)' % (kind, ', '.join('?' * (len(stats) + 2))), snapshots)
+      self._conn.commit()
+    return len(snapshots)
+
+  def history(self, kind:str, id, since:int = None) -> list: # stats rows for one entity, oldest first
+    with self._lock:
+      cursor = self._conn.execute('SELECT * FROM %s_stats WHERE id = ? AND observedAt >= ? ORDER BY observedAt' % kind, (str(id), since or 0))
+      names = [column[0] for column in cursor.description]
+      return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+  def growth(self, kind:str, id, stat:str, since:int = None) -> dict: # change in one counter between the first and last snapshot, and its rate per day
+    rows = [row for row in self.history(kind, id, since) if row[stat] is not None]
+    if not rows:
+      return None
+    first, last = rows[0], rows[-1]
+    elapsed = last['observedAt'] - first['observedAt']
+    delta = last[stat] - first[stat]
+    return {'first': first[stat], 'last': last[stat], 'delta': delta, 'perDay': delta * 86400 / elapsed if elapsed else None}
+
+  def followerGrowth(self, userId, since:int = None) -> dict:
+    return self.growth('user', userId, 'followerCount', since)
+
+  def playVelocity(self, videoId, since:int = None) -> dict:
+    return self.growth('video', videoId, 'playCount', since)
+
+  def close(self):
+    with self._lock:
+      self._conn.close()